@@ -0,0 +1,253 @@
+"""Общий для процессов кэш в файле SQLite в режиме WAL.
+
+LocMemCache живёт внутри одного воркера: каждый gunicorn-процесс греет
+свой кэш, а сброс версии в одном не виден другим. Этот бэкенд хранит
+записи в одном файле на хосте, поэтому все воркеры видят одни и те же
+ключи. WAL позволяет читать параллельно с записью, а размер кэша
+ограничен по байтам (MAX_BYTES) и по числу записей (MAX_ENTRIES):
+лишнее вытесняется по давности последнего чтения (LRU).
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_stats VALUES (1, 0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+    UPDATE cache_stats SET entries = entries + 1, bytes = bytes + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+    UPDATE cache_stats SET entries = entries - 1, bytes = bytes - old.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache
+BEGIN
+    UPDATE cache_stats SET bytes = bytes - old.size + new.size;
+END;
+'''
+
+RECOUNT = '''
+UPDATE cache_stats SET entries = (SELECT count(*) FROM cache),
+    bytes = (SELECT coalesce(sum(size), 0) FROM cache)
+'''
+
+# Время чтения обновляется не чаще раза в секунду: иначе каждое
+# попадание превращалось бы в запись.
+ACCESS_RESOLUTION = 1.0
+
+
+class SQLiteCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = os.path.abspath(location)
+        self._max_bytes = int(options.get('MAX_BYTES', 64 * 1024 * 1024))
+        self._busy_timeout = int(options.get('BUSY_TIMEOUT', 5000))
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        # Соединение своё у каждого потока и у каждого процесса после fork.
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self._path)
+            os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self._path, timeout=self._busy_timeout / 1000,
+                                 isolation_level=None,
+                                 check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(f'PRAGMA busy_timeout={self._busy_timeout}')
+            db.executescript(SCHEMA)
+            # Файл мог остаться от версии, где счётчики расходились с
+            # таблицей: пересчитываем их при открытии.
+            db.execute(RECOUNT)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _write(self):
+        return _Transaction(self._db)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _fetch(self, keys):
+        if not keys:
+            return {}
+        now = time.time()
+        placeholders = ','.join('?' * len(keys))
+        rows = self._db.execute(
+            f'SELECT key, value, accessed FROM cache '
+            f'WHERE key IN ({placeholders}) '
+            f'AND (expires IS NULL OR expires > ?)',
+            [*keys, now]).fetchall()
+        stale = [key for key, _, accessed in rows
+                 if accessed < now - ACCESS_RESOLUTION]
+        if stale:
+            placeholders = ','.join('?' * len(stale))
+            with self._write() as db:
+                db.execute(
+                    f'UPDATE cache SET accessed = ? '
+                    f'WHERE key IN ({placeholders})', [now, *stale])
+        return {key: pickle.loads(value) for key, value, _ in rows}
+
+    def _store(self, db, items, timeout, only_new=False):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        # Не INSERT OR REPLACE: его удаление старой строки не вызывает
+        # cache_delete, и счётчики в cache_stats только растут. UPSERT
+        # обновляет строку, а размер поправляет cache_update.
+        conflict = ('DO NOTHING' if only_new else
+                    'DO UPDATE SET value = excluded.value, '
+                    'expires = excluded.expires, '
+                    'accessed = excluded.accessed, size = excluded.size')
+        stored = 0
+        for key, value in items:
+            blob = self._dumps(value)
+            if expires is not None and expires <= now:
+                db.execute('DELETE FROM cache WHERE key = ?', [key])
+                continue
+            cursor = db.execute(
+                f'INSERT INTO cache (key, value, expires, accessed, size) '
+                f'VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) {conflict}',
+                [key, blob, expires, now, len(key) + len(blob)])
+            stored += cursor.rowcount
+        self._cull(db, now)
+        return stored
+
+    def _cull(self, db, now):
+        entries, size = db.execute(
+            'SELECT entries, bytes FROM cache_stats').fetchone()
+        if entries <= self._max_entries and size <= self._max_bytes:
+            return
+        db.execute('DELETE FROM cache WHERE expires <= ?', [now])
+        entries, size = db.execute(
+            'SELECT entries, bytes FROM cache_stats').fetchone()
+        while entries and (entries > self._max_entries
+                           or size > self._max_bytes):
+            # Как и встроенные бэкенды, режем долю cull_frequency за раз.
+            batch = max(entries // self._cull_frequency, 1)
+            db.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY accessed LIMIT ?)', [batch])
+            entries, size = db.execute(
+                'SELECT entries, bytes FROM cache_stats').fetchone()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._write() as db:
+            db.execute('DELETE FROM cache WHERE key = ? AND expires <= ?',
+                       [key, time.time()])
+            return bool(self._store(db, [(key, value)], timeout,
+                                    only_new=True))
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._fetch([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        mapping = {self._key(key, version): key for key in keys}
+        found = self._fetch(list(mapping))
+        return {mapping[key]: value for key, value in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._write() as db:
+            self._store(db, [(key, value)], timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        items = [(self._key(key, version), value)
+                 for key, value in data.items()]
+        with self._write() as db:
+            self._store(db, items, timeout)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._write() as db:
+            cursor = db.execute(
+                'UPDATE cache SET expires = ? '
+                'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                [self.get_backend_timeout(timeout), key, time.time()])
+            return bool(cursor.rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        with self._write() as db:
+            row = db.execute(
+                'SELECT value FROM cache '
+                'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                [key, time.time()]).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            blob = self._dumps(value)
+            db.execute('UPDATE cache SET value = ?, size = ? WHERE key = ?',
+                       [blob, len(key) + len(blob), key])
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._db.execute(
+            'SELECT 1 FROM cache '
+            'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            [key, time.time()]).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if not keys:
+            return
+        placeholders = ','.join('?' * len(keys))
+        with self._write() as db:
+            db.execute(f'DELETE FROM cache WHERE key IN ({placeholders})',
+                       keys)
+
+    def clear(self):
+        with self._write() as db:
+            db.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Соединения живут весь процесс: открывать файл на каждый запрос
+        # дороже, чем держать его открытым.
+        pass
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE: запись сразу берёт блокировку и не ловит deadlock."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.db.execute('COMMIT' if exc_type is None else 'ROLLBACK')
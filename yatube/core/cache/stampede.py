@@ -0,0 +1,79 @@
+"""Защита от лавины пересчётов при истечении ключа.
+
+Значение хранится в конверте (value, soft_expiry, delta): soft_expiry —
+момент, после которого значение считается устаревшим, delta — сколько
+длился последний пересчёт. Сам ключ живёт дольше на CACHE_STALE_GRACE,
+чтобы было что отдать, пока один запрос пересчитывает значение под
+блокировкой, а остальные получают старое. Ранний пересчёт (XFetch)
+начинается с вероятностью, растущей к soft_expiry, пропорционально
+delta и CACHE_EARLY_REFRESH_BETA.
+"""
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+WAIT_STEP = 0.05
+
+
+def _lock_key(key):
+    return f'lock:{key}'
+
+
+def _should_refresh(soft_expiry, delta, beta):
+    if soft_expiry is None:
+        return False
+    now = time.time()
+    if beta and delta:
+        now -= delta * beta * math.log(1.0 - random.random())
+    return now >= soft_expiry
+
+
+def _compute_and_store(cache, key, compute, timeout):
+    started = time.time()
+    value = compute()
+    delta = time.time() - started
+    soft_expiry = None if timeout is None else time.time() + timeout
+    hard_timeout = None
+    if timeout is not None:
+        hard_timeout = timeout + settings.CACHE_STALE_GRACE
+    cache.set(key, (value, soft_expiry, delta), hard_timeout)
+    return value
+
+
+def get_or_set(key, compute, timeout=DEFAULT_TIMEOUT, cache=None,
+               beta=None):
+    """Как cache.get_or_set, но пересчитывает значение один запрос.
+
+    compute вызывается без аргументов. Пока держатель блокировки считает,
+    остальные получают устаревшее значение, а если его нет — ждут до
+    CACHE_LOCK_TIMEOUT и только потом считают сами.
+    """
+    cache = cache or default_cache
+    if timeout is DEFAULT_TIMEOUT:
+        timeout = cache.default_timeout
+    if beta is None:
+        beta = settings.CACHE_EARLY_REFRESH_BETA
+    entry = cache.get(key)
+    if entry is not None and not _should_refresh(entry[1], entry[2], beta):
+        return entry[0]
+    lock_timeout = settings.CACHE_LOCK_TIMEOUT
+    if cache.add(_lock_key(key), 1, lock_timeout):
+        try:
+            return _compute_and_store(cache, key, compute, timeout)
+        finally:
+            cache.delete(_lock_key(key))
+    if entry is not None:
+        return entry[0]
+    deadline = time.time() + lock_timeout
+    while time.time() < deadline:
+        time.sleep(WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+        if not cache.has_key(_lock_key(key)):
+            break
+    return _compute_and_store(cache, key, compute, timeout)
@@ -0,0 +1,254 @@
+"""Двухуровневый кэш: LRU внутри процесса перед общим кэшем.
+
+Каждое чтение из общего кэша (core.cache.sqlite) — это сериализация и
+обращение к файлу, поэтому горячие ключи держатся в памяти процесса.
+Чтобы процессы не отдавали устаревшее, каждая запись через этот бэкенд
+увеличивает счётчик поколения в общем кэше и кладёт в журнал изменённый
+ключ. Журнал — кольцо из LOG_SIZE записей, каждая помнит своё
+поколение. Процесс сверяет поколение не чаще раза за запрос (и не реже
+раза в POLL_INTERVAL вне запросов) и выбрасывает из памяти ключи из
+журнала, а если отстал больше, чем на длину журнала, — всё сразу.
+
+Сколько значению осталось жить в общем кэше, при чтении неизвестно,
+поэтому прочитанное оттуда держится в памяти не дольше READ_TIMEOUT.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.signals import request_started
+
+GENERATION_KEY = 'tiered:generation'
+LOG_KEY = 'tiered:log:{}'
+IMMUTABLE = (str, bytes, int, float, bool, type(None))
+
+# Локальные уровни общие для всех потоков процесса, как у LocMemCache.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class _LocalStore:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.polled_at = 0.0
+        self.poll_requested = True
+        self.stats = dict.fromkeys(
+            ('local_hits', 'local_misses', 'shared_hits', 'shared_misses'),
+            0)
+
+    def get(self, key, now):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None or item[1] <= now:
+                self.data.pop(key, None)
+                return None
+            self.data.move_to_end(key)
+            return item
+
+    def put(self, key, value, expires):
+        with self.lock:
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def drop(self, keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+@request_started.connect
+def _request_poll(**kwargs):
+    for store in list(_stores.values()):
+        store.poll_requested = True
+
+
+def _freeze(value):
+    # Неизменяемые значения (фрагменты шаблонов) храним как есть, прочие
+    # копируем через pickle, как LocMemCache.
+    if isinstance(value, IMMUTABLE):
+        return False, value
+    return True, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _thaw(item):
+    pickled, value = item
+    return pickle.loads(value) if pickled else value
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED', 'shared')
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 300)
+        self._poll_interval = options.get('POLL_INTERVAL', 1.0)
+        self._log_size = options.get('LOG_SIZE', 1000)
+        self._read_timeout = options.get('READ_TIMEOUT', 30)
+        with _stores_lock:
+            self._store = _stores.setdefault(location or self._shared_alias,
+                                             _LocalStore(self._max_entries))
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def stats(self):
+        """Попадания и промахи по уровням в этом процессе."""
+        return dict(self._store.stats)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _poll(self):
+        store, now = self._store, time.monotonic()
+        if not store.poll_requested and (
+                now - store.polled_at < self._poll_interval):
+            return
+        store.poll_requested = False
+        store.polled_at = now
+        generation = self.shared.get(GENERATION_KEY, 0, version=0)
+        known = store.generation
+        store.generation = generation
+        if known is None or generation == known:
+            if known is None:
+                store.clear()
+            return
+        if generation < known or generation - known > self._log_size:
+            store.clear()
+            return
+        generations = range(known + 1, generation + 1)
+        logged = self.shared.get_many(
+            [self._log_key(n) for n in generations], version=0)
+        entries = [logged.get(self._log_key(n)) for n in generations]
+        # Запись кольца перезаписана более новым поколением или вытеснена.
+        if any(entry is None or entry[0] != n
+               for n, entry in zip(generations, entries)):
+            store.clear()
+            return
+        store.drop(key for _, key in entries)
+
+    def _log_key(self, generation):
+        return LOG_KEY.format(generation % self._log_size)
+
+    def _invalidate(self, keys):
+        """Сообщает другим процессам, что эти ключи изменились."""
+        keys = list(keys)
+        self._store.drop(keys)
+        if not keys:
+            return
+        shared = self.shared
+        shared.add(GENERATION_KEY, 0, timeout=None, version=0)
+        generation = shared.incr(GENERATION_KEY, len(keys), version=0)
+        first = generation - len(keys) + 1
+        # При переполнении кольца в ячейке остаётся более новое поколение.
+        shared.set_many(
+            {self._log_key(first + n): (first + n, key)
+             for n, key in enumerate(keys)},
+            timeout=None, version=0)
+        # Свои записи не должны выбрасывать собственный уровень целиком.
+        if self._store.generation == first - 1:
+            self._store.generation = generation
+
+    def _remember(self, key, value, timeout=DEFAULT_TIMEOUT):
+        ttl = self._local_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            ttl = min(ttl, timeout)
+        if ttl > 0:
+            self._store.put(key, _freeze(value), time.monotonic() + ttl)
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        self._poll()
+        store, now = self._store, time.monotonic()
+        mapping = {self._key(key, version): key for key in keys}
+        found, missing = {}, []
+        for key, original in mapping.items():
+            item = store.get(key, now)
+            if item is None:
+                missing.append(key)
+            else:
+                found[original] = _thaw(item[0])
+        store.stats['local_hits'] += len(found)
+        store.stats['local_misses'] += len(missing)
+        if missing:
+            # Ключи уже собраны: общему уровню отдаём их без префикса.
+            fetched = self.shared.get_many(missing, version=0)
+            store.stats['shared_hits'] += len(fetched)
+            store.stats['shared_misses'] += len(missing) - len(fetched)
+            for key, value in fetched.items():
+                self._remember(key, value, self._read_timeout)
+                found[mapping[key]] = value
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._poll()
+        items = {self._key(key, version): value
+                 for key, value in data.items()}
+        self.shared.set_many(items, timeout=self._shared_timeout(timeout),
+                             version=0)
+        self._invalidate(items)
+        for key, value in items.items():
+            self._remember(key, value, timeout)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        added = self.shared.add(key, value,
+                                timeout=self._shared_timeout(timeout),
+                                version=0)
+        if added:
+            self._invalidate([key])
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        touched = self.shared.touch(key,
+                                    timeout=self._shared_timeout(timeout),
+                                    version=0)
+        # Новый срок в памяти процессов не виден: пусть перечитают.
+        self._invalidate([key])
+        return touched
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        value = self.shared.incr(key, delta, version=0)
+        self._invalidate([key])
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        self.shared.delete_many(keys, version=0)
+        self._invalidate(keys)
+
+    def clear(self):
+        self.shared.clear()
+        self._store.clear()
+        self._store.generation = None
+
+    def _shared_timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
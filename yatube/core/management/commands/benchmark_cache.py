@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.cache.sqlite import SQLiteCache
+
+
+# Все ключи помещаются в кэш: меряем общий доступ, а не вытеснение.
+PARAMS = {'OPTIONS': {'MAX_ENTRIES': 10 ** 6}}
+
+
+def make_locmem(location):
+    return LocMemCache('benchmark', PARAMS)
+
+
+def make_sqlite(location):
+    return SQLiteCache(location, PARAMS)
+
+
+BACKENDS = (
+    ('LocMemCache', make_locmem),
+    ('SQLiteCache', make_sqlite),
+)
+
+
+def worker(factory, location, keys, ops, payload, seed, results):
+    cache = factory(location)
+    rng = random.Random(seed)
+    value = 'x' * payload
+    hits = 0
+    started = time.perf_counter()
+    for _ in range(ops):
+        key = f'key:{rng.randrange(keys)}'
+        if cache.get(key) is None:
+            cache.set(key, value)
+        else:
+            hits += 1
+    results.put((hits, time.perf_counter() - started))
+
+
+class Command(BaseCommand):
+    help = ('Гоняет get/set из нескольких процессов через LocMemCache и '
+            'SQLiteCache и печатает пропускную способность и долю попаданий.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--ops', type=int, default=20000,
+                            help='Операций на процесс.')
+        parser.add_argument('--keys', type=int, default=2000)
+        parser.add_argument('--payload', type=int, default=2048,
+                            help='Размер значения в байтах.')
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        self.stdout.write(f'{"бэкенд":<14}{"оп/с":>12}{"попадания":>12}')
+        for name, factory in BACKENDS:
+            with tempfile.TemporaryDirectory() as directory:
+                location = os.path.join(directory, 'cache.sqlite3')
+                results = context.Queue()
+                processes = [
+                    context.Process(target=worker, args=(
+                        factory, location, options['keys'], options['ops'],
+                        options['payload'], seed, results))
+                    for seed in range(options['processes'])]
+                for process in processes:
+                    process.start()
+                stats = [results.get() for _ in processes]
+                for process in processes:
+                    process.join()
+            total = options['ops'] * options['processes']
+            hits = sum(hit for hit, _ in stats)
+            elapsed = max(seconds for _, seconds in stats)
+            self.stdout.write(f'{name:<14}{total / elapsed:>12.0f}'
+                              f'{hits / total:>12.1%}')
@@ -0,0 +1,74 @@
+import os
+import pstats
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import dumps, make_token, parse_view
+
+# Поля записи pstats: (вызовы без рекурсии, все вызовы, собственное
+# время, время с вложенными, вызывающие).
+SORT_FIELDS = {'tottime': 2, 'cumtime': 3, 'calls': 1}
+
+
+def location(function):
+    filename, line, name = function
+    if filename == '~':
+        # Встроенные функции pstats записывает как ('~', 0, '<...>').
+        return name
+    parts = filename.split(os.sep)
+    if 'site-packages' in parts:
+        parts = parts[parts.index('site-packages') + 1:]
+    elif settings.BASE_DIR in filename:
+        parts = os.path.relpath(filename, settings.BASE_DIR).split(os.sep)
+    return f'{"/".join(parts[-3:])}:{line}({name})'
+
+
+class Command(BaseCommand):
+    help = ('Сводит дампы ProfilingMiddleware по view: сколько запросов, '
+            'среднее время и самые горячие функции.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help='Каталог дампов, по умолчанию '
+                                 'PROFILING_DIR.')
+        parser.add_argument('--view', action='append',
+                            help='Только эти view, например posts:profile.')
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--sort', choices=SORT_FIELDS,
+                            default='tottime')
+        parser.add_argument('--token', action='store_true',
+                            help='Напечатать значение заголовка X-Profile.')
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(make_token())
+            return
+        by_view = defaultdict(list)
+        for path in dumps(options['dir'] or settings.PROFILING_DIR):
+            view = parse_view(os.path.basename(path))
+            if not options['view'] or view in options['view']:
+                by_view[view].append(path)
+        if not by_view:
+            self.stdout.write('Дампов нет')
+            return
+        for view, paths in sorted(by_view.items(),
+                                  key=lambda item: -len(item[1])):
+            self.report(view, pstats.Stats(*paths), len(paths), options)
+
+    def report(self, view, stats, requests, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{view}: запросов {requests}, в среднем '
+            f'{stats.total_tt / requests * 1000:.1f} мс'))
+        self.stdout.write(f'{"собств., мс":>12}{"всего, мс":>12}'
+                          f'{"вызовов":>10}  функция')
+        field = SORT_FIELDS[options['sort']]
+        rows = sorted(stats.stats.items(), key=lambda item: -item[1][field])
+        for function, (_, calls, tottime, cumtime, _) in \
+                rows[:options['top']]:
+            # Время и вызовы — в среднем на запрос.
+            self.stdout.write(
+                f'{tottime / requests * 1000:>12.2f}'
+                f'{cumtime / requests * 1000:>12.2f}'
+                f'{calls / requests:>10.1f}  {location(function)}')
@@ -0,0 +1,309 @@
+"""Метрики запросов в текстовом формате Prometheus.
+
+MetricsMiddleware на каждый запрос записывает длительность, число и
+время SQL-запросов (через connection.execute_wrapper), время рендеринга
+шаблонов и попадания в кэш с меткой view — именем маршрута
+(posts:index, posts:profile, ...). Все значения — суммы: счётчики и
+корзины гистограмм. Поэтому воркеры не чаще раза в
+METRICS_FLUSH_INTERVAL секунд прибавляют накопленное к строкам общего
+файла SQLite (METRICS_PATH), а /metrics отдаёт итог по всем процессам.
+Без METRICS_PATH итоги копятся в памяти одного процесса.
+"""
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+from core.cache.sqlite import _Transaction
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+) WITHOUT ROWID;
+'''
+UPSERT = '''
+INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?)
+ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value
+'''
+
+# Границы корзин как у клиентов Prometheus по умолчанию.
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# (имя, тип, описание) в порядке вывода.
+FAMILIES = (
+    ('yatube_requests_total', 'counter',
+     'Запросы по view, методу и коду ответа.'),
+    ('yatube_request_duration_seconds', 'histogram',
+     'Время ответа, включая middleware.'),
+    ('yatube_request_queries', 'histogram',
+     'SQL-запросов на один запрос.'),
+    ('yatube_request_sql_seconds', 'histogram',
+     'Время SQL-запросов за один запрос.'),
+    ('yatube_request_template_seconds', 'histogram',
+     'Время рендеринга шаблонов за один запрос.'),
+    ('yatube_cache_requests_total', 'counter',
+     'Чтения ключей кэша по уровню и результату.'),
+)
+SUFFIXES = ('_bucket', '_sum', '_count')
+
+# Метка метода с ограниченным набором значений: произвольный метод из
+# запроса не должен плодить новые ряды.
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+UNRESOLVED = 'unresolved'
+# Ключи TieredCache.stats() вида local_hits → tier="local", result="hit".
+RESULTS = {'hits': 'hit', 'misses': 'miss'}
+
+_local = threading.local()
+
+
+def _escape(value):
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def _labels(pairs):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Registry:
+    """Приращения метрик процесса до следующего сброса в общий файл."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = defaultdict(float)
+        self.totals = defaultdict(float)
+        self.flushed_at = time.monotonic()
+        self.local = threading.local()
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.pending[name, _labels(labels)] += value
+
+    def observe(self, name, labels, value, buckets):
+        with self.lock:
+            # Корзины пишутся и нулевыми: Prometheus ждёт их все.
+            for bound in buckets:
+                key = _labels((*labels, ('le', float(bound))))
+                self.pending[f'{name}_bucket', key] += value <= bound
+            self.pending[f'{name}_bucket',
+                         _labels((*labels, ('le', '+Inf')))] += 1
+            self.pending[f'{name}_sum', _labels(labels)] += value
+            self.pending[f'{name}_count', _labels(labels)] += 1
+
+    def _db(self, path):
+        # Соединение своё у каждого потока и у каждого процесса после fork.
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.key != (path, os.getpid()):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            db = sqlite3.connect(path, timeout=5, isolation_level=None,
+                                 check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SCHEMA)
+            self.local.db = db
+            self.local.key = (path, os.getpid())
+        return db
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            if not force and (now - self.flushed_at
+                              < settings.METRICS_FLUSH_INTERVAL):
+                return
+            pending, self.pending = self.pending, defaultdict(float)
+            self.flushed_at = now
+        if not pending:
+            return
+        path = settings.METRICS_PATH
+        if path is None:
+            with self.lock:
+                for key, value in pending.items():
+                    self.totals[key] += value
+            return
+        try:
+            with _Transaction(self._db(path)) as db:
+                db.executemany(UPSERT, [(name, labels, value) for
+                                        (name, labels), value in
+                                        pending.items()])
+        except sqlite3.Error:
+            # Файл занят или недоступен: метрики не должны ронять ответ,
+            # приращения уйдут со следующим сбросом.
+            with self.lock:
+                for key, value in pending.items():
+                    self.pending[key] += value
+
+    def samples(self):
+        """{(имя, метки): значение} по всем процессам."""
+        self.flush(force=True)
+        path = settings.METRICS_PATH
+        if path is None:
+            with self.lock:
+                return dict(self.totals)
+        rows = self._db(path).execute(
+            'SELECT name, labels, value FROM metrics').fetchall()
+        return {(name, labels): value for name, labels, value in rows}
+
+    def render(self):
+        samples = self.samples()
+        lines = []
+        for family, kind, help_text in FAMILIES:
+            names = ([family] if kind == 'counter'
+                     else [family + suffix for suffix in SUFFIXES])
+            series = [(name, labels, value)
+                      for (name, labels), value in samples.items()
+                      if name in names]
+            if not series:
+                continue
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+            series.sort(key=lambda row: _order(names, *row))
+            for name, labels, value in series:
+                lines.append(f'{name}{{{labels}}} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _order(names, name, labels, value):
+    # Ряды гистограммы по порядку: корзины по возрастанию границы, затем
+    # _sum и _count, и всё это подряд для каждого набора меток.
+    base, _, bound = labels.partition(',le="')
+    bound = bound.rstrip('"')
+    le = float('inf') if bound in ('', '+Inf') else float(bound)
+    return base, names.index(name), le
+
+
+registry = Registry()
+atexit.register(registry.flush, force=True)
+
+
+class _RequestState:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+def _cache_stats():
+    """Счётчики уровней кэшей, которые их ведут (core.cache.tiered)."""
+    stats = {}
+    for alias in settings.CACHES:
+        backend = caches[alias]
+        if hasattr(backend, 'stats'):
+            stats[alias] = backend.stats()
+    return stats
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNRESOLVED
+    return match.view_name
+
+
+class MetricsMiddleware:
+    """Снимает метрики запроса; ставится первым, чтобы учесть остальные.
+
+    Разница счётчиков кэша за запрос точна для воркеров с одним потоком:
+    при нескольких потоках в неё попадают чтения соседних запросов.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = _RequestState()
+        _local.state = state
+        cache_before = _cache_stats()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(state))
+                response = self.get_response(request)
+        finally:
+            _local.state = None
+        duration = time.perf_counter() - started
+        self.record(request, response, state, duration, cache_before)
+        registry.flush()
+        return response
+
+    def record(self, request, response, state, duration, cache_before):
+        view = (('view', view_name(request)),)
+        method = request.method if request.method in METHODS else 'other'
+        registry.inc('yatube_requests_total',
+                     (*view, ('method', method),
+                      ('status', response.status_code)))
+        registry.observe('yatube_request_duration_seconds', view, duration,
+                         SECONDS_BUCKETS)
+        registry.observe('yatube_request_queries', view, state.queries,
+                         QUERY_BUCKETS)
+        registry.observe('yatube_request_sql_seconds', view,
+                         state.sql_seconds, SECONDS_BUCKETS)
+        registry.observe('yatube_request_template_seconds', view,
+                         state.template_seconds, SECONDS_BUCKETS)
+        for alias, after in _cache_stats().items():
+            before = cache_before.get(alias, {})
+            for key, value in after.items():
+                delta = value - before.get(key, 0)
+                if delta <= 0:
+                    continue
+                tier, _, result = key.partition('_')
+                registry.inc('yatube_cache_requests_total',
+                             (*view, ('cache', alias), ('tier', tier),
+                              ('result', RESULTS.get(result, result))),
+                             delta)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        state = getattr(_local, 'state', None)
+        if state is None:
+            return super().render(context, request)
+        # Вложенный render_to_string уже входит во время внешнего.
+        state.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            state.template_depth -= 1
+            if not state.template_depth:
+                state.template_seconds += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Бэкенд шаблонов Django, который замеряет время рендеринга."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
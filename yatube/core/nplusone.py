@@ -0,0 +1,181 @@
+"""Поиск N+1 запросов и бюджеты запросов для тестов.
+
+Каждый SELECT приводится к отпечатку: без значений, с одним «...» на
+месте списка IN (...). Если за запрос один и тот же отпечаток
+встретился больше NPLUSONE_THRESHOLD раз, это почти наверняка обращение
+к связанному объекту в цикле. NPlusOneMiddleware в этом случае пишет
+предупреждение или, в тестах, бросает NPlusOneError с местом, откуда
+пришёл повторяющийся запрос: строкой шаблона или нашего кода. Известные
+повторы исключает NPLUSONE_IGNORE.
+
+query_budget — контекстный менеджер и декоратор для тестов: проверяет
+общее число запросов и число повторов одного отпечатка в блоке.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Node
+
+logger = logging.getLogger(__name__)
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\bIN \((?:[^()]*)\)')
+SPACE_RE = re.compile(r'\s+')
+
+# Кадры из этих каталогов не интересны: ищем первый кадр проекта. core
+# тоже пропускается: его middleware оборачивают все запросы к базе.
+LIBRARY_PATHS = tuple({os.path.dirname(os.__file__),
+                       os.path.dirname(os.path.dirname(
+                           sys.modules['django'].__file__)),
+                       os.path.dirname(__file__)})
+
+_local = threading.local()
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """Форма запроса без значений: одинакова для всех строк цикла."""
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def origin():
+    """Откуда пришёл запрос: строка шаблона или кадр кода проекта."""
+    code = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        if isinstance(node, Node) and getattr(node, 'token', None):
+            # Самый вложенный узел шаблона — переменная или тег, который
+            # обратился к связанному объекту.
+            return f'{node.origin.name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if code is None and not filename.startswith(LIBRARY_PATHS):
+            code = f'{filename}:{frame.f_lineno}'
+        frame = frame.f_back
+    return code or '?'
+
+
+@contextmanager
+def ignored():
+    """Запросы внутри блока не считаются повторами.
+
+    Для чужого кода, который читает свои записи по одной и где это не
+    исправить, например для создания миниатюр в sorl-thumbnail.
+    """
+    depth = getattr(_local, 'ignored', 0)
+    _local.ignored = depth + 1
+    try:
+        yield
+    finally:
+        _local.ignored = depth
+
+
+class QueryTracker:
+    """execute_wrapper, который считает SELECT по отпечаткам."""
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold
+        self.total = 0
+        self.counts = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        if not getattr(_local, 'ignored', 0) \
+                and sql.lstrip().upper().startswith('SELECT'):
+            key = fingerprint(sql)
+            self.counts[key] += 1
+            # Место запоминаем один раз, на первом лишнем повторе.
+            if self.threshold is not None and key not in self.origins \
+                    and self.counts[key] > self.threshold:
+                self.origins[key] = origin()
+        return execute(sql, params, many, context)
+
+    def track(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+    def repeated(self, limit):
+        ignore = [re.compile(pattern)
+                  for pattern in settings.NPLUSONE_IGNORE]
+        return [(key, count) for key, count in self.counts.most_common()
+                if count > limit
+                and not any(pattern.search(key) for pattern in ignore)]
+
+    def report(self, limit):
+        return '\n'.join(
+            f'{count} раз из {self.origins.get(key, "?")}: {key[:300]}'
+            for key, count in self.repeated(limit))
+
+
+class NPlusOneMiddleware:
+    """Сообщает о повторах одного запроса при NPLUSONE_ACTION."""
+
+    def __init__(self, get_response):
+        if settings.NPLUSONE_ACTION is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = settings.NPLUSONE_THRESHOLD
+        tracker = QueryTracker(threshold)
+        with tracker.track():
+            response = self.get_response(request)
+        if tracker.repeated(threshold):
+            message = (f'N+1 в {request.method} {request.path}:\n'
+                       f'{tracker.report(threshold)}')
+            if settings.NPLUSONE_ACTION == 'raise':
+                raise NPlusOneError(message)
+            logger.warning(message)
+        return response
+
+
+class query_budget(ContextDecorator):
+    """Не больше queries запросов и repeats повторов одного отпечатка.
+
+        with query_budget(6):
+            self.client.get(url)
+    """
+
+    def __init__(self, queries=None, repeats=None):
+        self.queries = queries
+        self.repeats = (settings.NPLUSONE_THRESHOLD if repeats is None
+                        else repeats)
+
+    def __enter__(self):
+        self.tracker = QueryTracker(self.repeats)
+        self.stack = self.tracker.track()
+        self.stack.__enter__()
+        return self.tracker
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stack.__exit__(exc_type, exc, traceback)
+        if exc_type is not None:
+            return False
+        tracker = self.tracker
+        if self.queries is not None and tracker.total > self.queries:
+            raise NPlusOneError(
+                f'{tracker.total} запросов при бюджете {self.queries}:\n'
+                + '\n'.join(f'{count} × {key[:300]}'
+                            for key, count in tracker.counts.most_common()))
+        if tracker.repeated(self.repeats):
+            raise NPlusOneError(
+                f'Повторяющиеся запросы:\n{tracker.report(self.repeats)}')
+        return False
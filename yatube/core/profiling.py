@@ -0,0 +1,98 @@
+"""Профилирование отдельных запросов на живом воркере.
+
+ProfilingMiddleware включает cProfile для доли запросов
+PROFILING_SAMPLE_RATE или для запроса с подписанным заголовком
+X-Profile (значение выдаёт manage.py profile_report --token). Дампы
+pstats кладутся в PROFILING_DIR под именем с view, старые удаляются
+сверх PROFILING_MAX_FILES. Свести их в отчёт по view и самым горячим
+функциям — manage.py profile_report.
+"""
+import cProfile
+import os
+import random
+import time
+from urllib.parse import quote, unquote
+
+from django.conf import settings
+from django.core import signing
+
+from core.metrics import view_name
+
+HEADER = 'HTTP_X_PROFILE'
+SALT = 'core.profiling'
+TOKEN_VALUE = 'profile'
+SUFFIX = '.prof'
+
+
+def make_token():
+    return signing.TimestampSigner(salt=SALT).sign(TOKEN_VALUE)
+
+
+def is_signed(token):
+    try:
+        value = signing.TimestampSigner(salt=SALT).unsign(
+            token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return value == TOKEN_VALUE
+
+
+def dump_name(view):
+    # view в имени файла, чтобы отчёт группировал дампы без их чтения.
+    return (f'{quote(view, safe="")}__{time.time_ns()}_{os.getpid()}'
+            f'{SUFFIX}')
+
+
+def parse_view(name):
+    return unquote(name.rsplit('__', 1)[0])
+
+
+def dumps(directory):
+    """Дампы каталога от старых к новым."""
+    try:
+        entries = [entry for entry in os.scandir(directory)
+                   if entry.name.endswith(SUFFIX)]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    return [entry.path for entry in entries]
+
+
+def prune(directory, limit):
+    paths = dumps(directory)
+    for path in paths[:max(len(paths) - limit, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Тот же дамп мог удалить соседний воркер.
+            pass
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        token = request.META.get(HEADER)
+        if token is not None:
+            return is_signed(token)
+        rate = settings.PROFILING_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.disable()
+        directory = settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+        name = dump_name(view_name(request))
+        profile.dump_stats(os.path.join(directory, name))
+        prune(directory, settings.PROFILING_MAX_FILES)
+        if HEADER in request.META:
+            response['X-Profile-Dump'] = name
+        return response
@@ -0,0 +1,48 @@
+from django import template
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.templatetags import cache as django_cache
+
+from core.cache.stampede import get_or_set
+
+register = template.Library()
+
+
+class SingleFlightCacheNode(django_cache.CacheNode):
+    def render(self, context):
+        try:
+            expire_time = self.expire_time_var.resolve(context)
+            cache_name = (self.cache_name.resolve(context)
+                          if self.cache_name else None)
+        except template.VariableDoesNotExist as error:
+            raise template.TemplateSyntaxError(
+                f'"cache" tag got an unknown variable: {error}')
+        if expire_time is not None:
+            try:
+                expire_time = int(expire_time)
+            except (ValueError, TypeError):
+                raise template.TemplateSyntaxError(
+                    f'"cache" tag got a non-integer timeout value: '
+                    f'{expire_time!r}')
+        try:
+            fragment_cache = caches[cache_name or 'template_fragments']
+        except InvalidCacheBackendError:
+            if cache_name:
+                raise template.TemplateSyntaxError(
+                    f'Invalid cache name specified for cache tag: '
+                    f'{cache_name!r}')
+            fragment_cache = caches['default']
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+        return get_or_set(key, lambda: self.nodelist.render(context),
+                          expire_time, cache=fragment_cache)
+
+
+@register.tag('cache')
+def do_cache(parser, token):
+    """{% cache %} с тем же синтаксисом, что у django, но фрагмент
+    пересчитывает один запрос, а остальные получают старую версию."""
+    node = django_cache.do_cache(parser, token)
+    return SingleFlightCacheNode(node.nodelist, node.expire_time_var,
+                                 node.fragment_name, node.vary_on,
+                                 node.cache_name)
@@ -1,6 +1,22 @@
+import os
+import shutil
+import tempfile
+import time
 from http import HTTPStatus
+from io import StringIO
 
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.template import Context, Template, TemplateSyntaxError
+from django.test import TestCase, override_settings
+
+from core.cache.sqlite import SQLiteCache
+from core.cache.stampede import get_or_set
+from core.cache.tiered import TieredCache
+from core.metrics import Registry
+from core.nplusone import NPlusOneError, fingerprint, query_budget
+from core.profiling import dumps, make_token
 
 
 class ViewTestClass(TestCase):
@@ -8,3 +24,375 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class SQLiteCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.location = os.path.join(directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location, {})
+
+    def test_basic_api(self):
+        """get/set/add/delete/incr/touch работают как у LocMemCache,
+        а cache_stats совпадает с таблицей."""
+        cache = self.cache
+        cache.set('key', {'a': 1})
+        self.assertEqual(cache.get('key'), {'a': 1})
+        self.assertFalse(cache.add('key', 'other'))
+        self.assertTrue(cache.add('new', 'value'))
+        cache.set_many({'x': 1, 'y': 2})
+        self.assertEqual(cache.get_many(['x', 'y', 'z']), {'x': 1, 'y': 2})
+        self.assertEqual(cache.incr('x', 10), 11)
+        self.assertEqual(cache.decr('x'), 10)
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+        cache.delete_many(['x', 'y'])
+        self.assertIsNone(cache.get('x'))
+        self.assertTrue(cache.touch('key', 0))
+        self.assertFalse(cache.has_key('key'))
+        cache.clear()
+        self.assertIsNone(cache.get('new'))
+        # Перезапись ключа не раздувает счётчики, по которым вытесняем.
+        for version in range(50):
+            cache.set('feed_version', 'v' * version)
+        self.assertTrue(cache.add('other', 1))
+        self.assertFalse(cache.add('other', 2))
+        cache.incr('other')
+        stats = cache._db.execute(
+            'SELECT entries, bytes FROM cache_stats').fetchone()
+        real = cache._db.execute(
+            'SELECT count(*), sum(size) FROM cache').fetchone()
+        self.assertEqual(stats, real)
+        self.assertEqual(stats[0], 2)
+
+    def test_settings_use_real_backends(self):
+        """Тесты по умолчанию идут через боевые бэкенды кэша."""
+        self.assertIsInstance(caches['default'], TieredCache)
+        self.assertIsInstance(caches['shared'], SQLiteCache)
+
+    def test_shared_between_instances(self):
+        """Запись из одного экземпляра (процесса) видна другому."""
+        SQLiteCache(self.location, {}).set('shared', 42)
+        self.assertEqual(self.cache.get('shared'), 42)
+
+    def test_lru_eviction_by_size(self):
+        """При превышении MAX_BYTES вытесняются давно читанные ключи."""
+        cache = SQLiteCache(self.location, {'OPTIONS': {'MAX_BYTES': 5000}})
+        cache.set('old', 'x' * 2000)
+        cache.set('hot', 'x' * 2000)
+        cache._db.execute("UPDATE cache SET accessed = 0 WHERE key LIKE "
+                          "'%old'")
+        cache.set('new', 'x' * 2000)
+        self.assertIsNone(cache.get('old'))
+        self.assertIsNotNone(cache.get('new'))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-tests',
+    },
+})
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        # Разные LOCATION — разные локальные уровни, как в двух воркерах.
+        self.first = TieredCache('first', {})
+        self.second = TieredCache('second', {})
+        self.first.clear()
+        self.second.clear()
+
+    def test_local_tier_serves_hot_keys(self):
+        """Повторное чтение не ходит в общий уровень."""
+        self.first.set('key', 'value')
+        self.second.get('key')
+        self.second.get('key')
+        stats = self.second.stats()
+        self.assertEqual(stats['shared_hits'], 1)
+        self.assertGreaterEqual(stats['local_hits'], 1)
+
+    def test_write_invalidates_other_process(self):
+        """Запись в одном процессе выбрасывает ключ из памяти другого."""
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.second._store.poll_requested = True
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.delete('key')
+        self.second._store.poll_requested = True
+        self.assertIsNone(self.second.get('key'))
+
+    def test_log_is_a_ring(self):
+        """Журнал занимает не больше LOG_SIZE ключей, а отставший
+        процесс сбрасывает память целиком."""
+        first = TieredCache('first', {'OPTIONS': {'LOG_SIZE': 4}})
+        second = TieredCache('second', {'OPTIONS': {'LOG_SIZE': 4}})
+        first.set('key', 'old')
+        self.assertEqual(second.get('key'), 'old')
+        for n in range(10):
+            first.set(f'other{n}', n)
+        first.set('key', 'new')
+        logged = [key for key in caches['shared']._cache
+                  if 'tiered:log:' in key]
+        self.assertEqual(len(logged), 4)
+        second._store.poll_requested = True
+        self.assertEqual(second.get('key'), 'new')
+
+    def test_touch_and_read_timeout(self):
+        """touch сбрасывает память процессов, а прочитанное из общего
+        уровня живёт в ней не дольше READ_TIMEOUT."""
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        expires = self.second._store.data[self.second._key('key', None)][1]
+        self.assertLessEqual(expires - time.monotonic(), 30)
+        self.first.touch('key', 0)
+        self.second._store.poll_requested = True
+        self.assertIsNone(self.second.get('key'))
+        self.assertIsNone(self.first.get('key'))
+
+    def test_mutable_values_are_copied(self):
+        """Изменение полученного значения не портит локальный уровень."""
+        self.first.set('list', [1])
+        self.first.get('list').append(2)
+        self.assertEqual(self.first.get('list'), [1])
+
+
+class TieredOverSQLiteTests(TestCase):
+    """Связка, как в работе: TieredCache поверх SQLiteCache."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.'
+                                   'LocMemCache'},
+            'shared': {
+                'BACKEND': 'core.cache.sqlite.SQLiteCache',
+                'LOCATION': os.path.join(directory, 'cache.sqlite3'),
+                'OPTIONS': {'MAX_ENTRIES': 60},
+            },
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        options = {'OPTIONS': {'LOG_SIZE': 8}}
+        self.first = TieredCache('integration-first', options)
+        self.second = TieredCache('integration-second', options)
+        self.first.clear()
+        self.second.clear()
+
+    def test_overwrites_do_not_evict_live_keys(self):
+        """Частая перезапись версии не вытесняет остальные ключи, а
+        изменения видны другому процессу."""
+        self.first.set_many({f'card:{n}': n for n in range(20)})
+        for version in range(200):
+            self.first.set('feed_version:index', version)
+        self.second._store.poll_requested = True
+        self.assertEqual(self.second.get('feed_version:index'), 199)
+        self.assertEqual(
+            len(self.second.get_many([f'card:{n}' for n in range(20)])),
+            20)
+        self.first.set('card:0', 'new')
+        self.second._store.poll_requested = True
+        self.assertEqual(self.second.get('card:0'), 'new')
+
+
+class StampedeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return f'значение {self.calls}'
+
+    def test_value_is_computed_once(self):
+        """Свежее значение отдаётся из кэша без пересчёта."""
+        self.assertEqual(get_or_set('key', self.compute, 60, beta=0),
+                         'значение 1')
+        self.assertEqual(get_or_set('key', self.compute, 60, beta=0),
+                         'значение 1')
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_served_while_locked(self):
+        """Пока другой запрос держит блокировку, отдаётся старое."""
+        get_or_set('key', self.compute, 0, beta=0)
+        cache.add('lock:key', 1)
+        self.assertEqual(get_or_set('key', self.compute, 60, beta=0),
+                         'значение 1')
+        cache.delete('lock:key')
+        self.assertEqual(get_or_set('key', self.compute, 60, beta=0),
+                         'значение 2')
+
+    def test_early_refresh(self):
+        """С большим beta значение обновляется до истечения."""
+        get_or_set('key', self.compute, 60, beta=0)
+        cache.set('key', ('значение 1', time.time() + 60, 1.0))
+        get_or_set('key', self.compute, 60, beta=10 ** 6)
+        self.assertEqual(self.calls, 2)
+
+    def test_cache_tag(self):
+        """Тег {% cache %} из fragment_cache кэширует фрагмент."""
+        template = Template('{% load fragment_cache %}'
+                            '{% cache 60 fragment %}{{ value }}'
+                            '{% endcache %}')
+        self.assertEqual(template.render(Context({'value': 'a'})), 'a')
+        self.assertEqual(template.render(Context({'value': 'b'})), 'a')
+        broken = Template('{% load fragment_cache %}'
+                          '{% cache timeout fragment %}{% endcache %}')
+        with self.assertRaisesMessage(TemplateSyntaxError,
+                                      'non-integer timeout value'):
+            broken.render(Context({'timeout': 'soon'}))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'metrics.sqlite3')
+        override = override_settings(METRICS_PATH=self.path)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_request_is_recorded(self):
+        """Запрос попадает в /metrics с именем view, SQL и шаблонами."""
+        self.client.get('/')
+        self.client.get('/nonexist-page/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('# TYPE yatube_request_duration_seconds histogram',
+                      text)
+        self.assertIn('yatube_requests_total{view="posts:index",'
+                      'method="GET",status="200"} 1\n', text)
+        self.assertIn('yatube_requests_total{view="unresolved",'
+                      'method="GET",status="404"} 1\n', text)
+        self.assertIn('yatube_request_duration_seconds_bucket'
+                      '{view="posts:index",le="+Inf"} 1\n', text)
+        self.assertIn('yatube_request_queries_count{view="posts:index"} 1',
+                      text)
+        self.assertIn('yatube_request_template_seconds_count'
+                      '{view="posts:index"} 1', text)
+        self.assertNotIn('yatube_request_queries_bucket{view="posts:index",'
+                         'le="+Inf"} 0', text)
+
+    def test_workers_are_summed(self):
+        """Приращения разных процессов складываются в общем файле."""
+        first, second = Registry(), Registry()
+        first.observe('yatube_request_queries', (('view', 'a'),), 3,
+                      (1, 5))
+        second.observe('yatube_request_queries', (('view', 'a'),), 7,
+                       (1, 5))
+        first.flush(force=True)
+        second.flush(force=True)
+        lines = [line for line in Registry().render().splitlines()
+                 if not line.startswith('#')]
+        self.assertEqual(lines, [
+            'yatube_request_queries_bucket{view="a",le="1.0"} 0',
+            'yatube_request_queries_bucket{view="a",le="5.0"} 1',
+            'yatube_request_queries_bucket{view="a",le="+Inf"} 2',
+            'yatube_request_queries_sum{view="a"} 10',
+            'yatube_request_queries_count{view="a"} 2',
+        ])
+
+    def test_label_values_are_escaped(self):
+        registry = Registry()
+        registry.inc('yatube_requests_total', (('view', 'a"b\\c\nd'),))
+        self.assertIn(r'{view="a\"b\\c\nd"} 1', registry.render())
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'core.cache.tiered.TieredCache',
+                    'LOCATION': 'metrics-test'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                   'LOCATION': 'metrics-test-shared'},
+    })
+    def test_cache_hits(self):
+        """Попадания в уровни TieredCache считаются по view."""
+        self.client.get('/')
+        self.client.get('/')
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('yatube_cache_requests_total{view="posts:index",'
+                      'cache="default",tier="local",result="hit"}', text)
+
+    def test_forbidden_for_other_hosts(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+
+
+class NPlusOneTests(TestCase):
+    def test_fingerprint(self):
+        """Значения и длина списка IN не меняют отпечаток."""
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 1 AND b = 'x''y'"),
+            fingerprint("SELECT * FROM t WHERE a = 25 AND b = 'z'"))
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s)'))
+
+    def test_repeats_point_to_template(self):
+        """Повтор запроса в цикле шаблона указывает на строку шаблона."""
+        User = get_user_model()
+        for i in range(6):
+            User.objects.create_user(username=f'user{i}')
+        template = Template('{% for user in users %}\n'
+                            '{{ user.groups.count }}\n'
+                            '{% endfor %}')
+        with self.assertRaisesRegex(NPlusOneError,
+                                    r'6 раз из <unknown source>:2'):
+            with query_budget():
+                template.render(Context({'users': User.objects.all()}))
+
+    def test_budget(self):
+        User = get_user_model()
+        with query_budget(1):
+            list(User.objects.all())
+        with self.assertRaisesRegex(NPlusOneError, 'бюджете 1'):
+            with query_budget(1):
+                User.objects.count()
+                User.objects.exists()
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        override = override_settings(PROFILING_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_signed_header(self):
+        """Запрос с подписанным заголовком профилируется, с чужим — нет."""
+        self.client.get('/', HTTP_X_PROFILE='profile:forged:signature')
+        self.assertEqual(dumps(self.directory), [])
+        response = self.client.get('/', HTTP_X_PROFILE=make_token())
+        paths = dumps(self.directory)
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         [response['X-Profile-Dump']])
+        self.assertTrue(response['X-Profile-Dump'].startswith(
+            'posts%3Aindex__'))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_MAX_FILES=2)
+    def test_sampling_and_limit(self):
+        """Сэмплированные дампы не копятся сверх PROFILING_MAX_FILES."""
+        for _ in range(3):
+            self.client.get('/')
+        self.assertEqual(len(dumps(self.directory)), 2)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_report(self):
+        """Отчёт группирует дампы по view и показывает функции."""
+        self.client.get('/')
+        self.client.get('/')
+        self.client.get('/about/author/')
+        out = StringIO()
+        call_command('profile_report', top=5, stdout=out)
+        report = out.getvalue()
+        self.assertIn('posts:index: запросов 2', report)
+        self.assertIn('about:author: запросов 1', report)
+        out = StringIO()
+        call_command('profile_report', view=['about:author'], stdout=out)
+        self.assertNotIn('posts:index', out.getvalue())
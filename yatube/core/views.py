@@ -1,4 +1,10 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.views.decorators.cache import never_cache
+
+from core.metrics import registry
 
 
 def page_not_found(request, exception):
@@ -15,3 +21,13 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@never_cache
+def metrics(request):
+    """Метрики всех воркеров в текстовом формате Prometheus."""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise PermissionDenied
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
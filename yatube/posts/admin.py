@@ -1,9 +1,26 @@
 from django.contrib import admin
+from django.db import connection
 
-from .models import Post, Group, Comment, Follow
+from .models import Post, Group, Comment, Follow, UserStats
+from .search import is_supported, match_query, matching_ids
 
 
-class PostAdmin(admin.ModelAdmin):
+class FullTextSearchMixin:
+    """Поиск в админке по индексу FTS5 вместо LIKE '%слово%'."""
+
+    search_index = None
+
+    def get_search_results(self, request, queryset, search_term):
+        query = match_query(search_term)
+        if not query or not is_supported(connection):
+            return super().get_search_results(request, queryset,
+                                              search_term)
+        return (queryset.filter(id__in=matching_ids(self.search_index,
+                                                    query)),
+                False)
+
+
+class PostAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = (
         'pk',
         'text',
@@ -13,6 +30,7 @@ class PostAdmin(admin.ModelAdmin):
     )
     list_editable = ('group',)
     search_fields = ('text',)
+    search_index = 'posts_post_fts'
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
@@ -25,10 +43,11 @@ class GroupAdmin(admin.ModelAdmin):
     )
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('pk', 'post', 'author', 'text', 'created')
     list_filter = ('author',)
-    search_fields = ('author', 'created')
+    search_fields = ('text',)
+    search_index = 'posts_comment_fts'
 
 
 class FollowAdmin(admin.ModelAdmin):
@@ -37,7 +56,14 @@ class FollowAdmin(admin.ModelAdmin):
     search_fields = ('author', 'user')
 
 
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'posts_count', 'followers_count',
+                    'following_count')
+    readonly_fields = ('posts_count', 'followers_count', 'following_count')
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(UserStats, UserStatsAdmin)
@@ -0,0 +1,87 @@
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db import transaction
+
+# Общий скоуп, который входит в версию любой ленты: его сдвигают редкие
+# правки, задевающие много лент сразу (переименование автора, группы).
+ALL_FEEDS = 'all'
+
+
+def _key(scope):
+    return f'feed_version:{scope}'
+
+
+def index_scope():
+    return 'index'
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def profile_scope(author_id):
+    return f'profile:{author_id}'
+
+
+def follow_scope(user_id):
+    return f'follow:{user_id}'
+
+
+def pulled_scope():
+    # Посты популярных авторов не раскладываются, и их подписчиков
+    # слишком много, чтобы сдвигать ленту каждого: у всех лент подписок
+    # с такими авторами одна общая версия.
+    return 'pulled'
+
+
+def feed_versions(*scopes):
+    """Версии скоупов ленты вместе с общим; версия — время её сдвига."""
+    scopes = (ALL_FEEDS,) + scopes
+    versions = cache.get_many([_key(scope) for scope in scopes])
+    missing = {_key(scope): _new_version() for scope in scopes
+               if _key(scope) not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[_key(scope)] for scope in scopes]
+
+
+def feed_version(*scopes):
+    """Версия фрагментов ленты: меняется при любой правке её постов."""
+    return '-'.join(feed_versions(*scopes))
+
+
+def feed_last_modified(versions):
+    """Last-Modified ленты: момент последнего сдвига её версий."""
+    return datetime.fromtimestamp(max(map(float, versions)),
+                                  tz=timezone.utc)
+
+
+def _new_version():
+    return f'{time.time():.6f}'
+
+
+def _bump(scopes):
+    version = _new_version()
+    cache.set_many({_key(scope): version for scope in scopes}, timeout=None)
+
+
+def bump_feeds(*scopes):
+    """Сбрасывает кэш лент сразу и ещё раз после коммита.
+
+    Второй сброс нужен, чтобы страницу, отрисованную до коммита по
+    старым данным, не отдавали из кэша под новой версией.
+    """
+    scopes = set(scopes)
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def post_scopes(post, group_ids=()):
+    scopes = {index_scope(), profile_scope(post.author_id)}
+    for group_id in {post.group_id, *group_ids}:
+        if group_id is not None:
+            scopes.add(group_scope(group_id))
+    return scopes
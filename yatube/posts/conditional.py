@@ -0,0 +1,113 @@
+"""ETag и Last-Modified для лент и страницы поста.
+
+Функции вызывает декоратор condition до самой вьюхи: если клиент
+прислал совпадающий If-None-Match или If-Modified-Since, страница не
+запрашивается и не рендерится, а уходит пустой 304. Ленты сверяются по
+версиям из posts.caching (одно обращение к кэшу на запрос), пост — по
+одной строке с updated_at и версиям лент его автора и группы: имена
+автора и группы на странице поста меняются без правки самого поста.
+"""
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.middleware.csrf import get_token
+
+from .caching import (feed_last_modified, feed_versions, follow_scope,
+                      group_scope, index_scope, profile_scope)
+from .models import Group, Post
+
+User = get_user_model()
+
+
+def _etag(request, *parts):
+    # Шапка страницы зависит от пользователя, список — от параметров.
+    parts = (request.user.pk, request.GET.urlencode(), *parts)
+    if request.user.is_authenticated:
+        # В формах вошедшего пользователя CSRF-токен: после повторного
+        # входа старая страница из кэша браузера отправила бы чужой.
+        parts += (get_token(request),)
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _feed_state(request, scopes_func, *args):
+    state = getattr(request, '_feed_state', None)
+    if state is None:
+        scopes = scopes_func(request, *args)
+        state = request._feed_state = (
+            None if scopes is None else feed_versions(*scopes))
+    return state
+
+
+def _index_scopes(request):
+    return [index_scope()]
+
+
+def _group_scopes(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    return None if group_id is None else [group_scope(group_id)]
+
+
+def _profile_scopes(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if author_id is None:
+        return None
+    scopes = [profile_scope(author_id)]
+    if request.user.is_authenticated:
+        # Кнопка подписки зависит от подписок смотрящего.
+        scopes.append(follow_scope(request.user.pk))
+    return scopes
+
+
+def _feed_condition(scopes_func):
+    def etag(request, *args, **kwargs):
+        versions = _feed_state(request, scopes_func, *kwargs.values())
+        return None if versions is None else _etag(request, *versions)
+
+    def last_modified(request, *args, **kwargs):
+        versions = _feed_state(request, scopes_func, *kwargs.values())
+        return None if versions is None else feed_last_modified(versions)
+
+    return {'etag_func': etag, 'last_modified_func': last_modified}
+
+
+index_condition = _feed_condition(_index_scopes)
+group_condition = _feed_condition(_group_scopes)
+profile_condition = _feed_condition(_profile_scopes)
+
+
+def _post_state(request, post_id):
+    state = getattr(request, '_post_state', None)
+    if state is None:
+        row = Post.objects.filter(pk=post_id).values_list(
+            'updated_at', 'author__stats__posts_count', 'author_id',
+            'group_id').first()
+        if row is not None:
+            updated_at, posts_count, author_id, group_id = row
+            scopes = [profile_scope(author_id)]
+            if group_id is not None:
+                scopes.append(group_scope(group_id))
+            row = (updated_at, posts_count, feed_versions(*scopes))
+        state = request._post_state = row
+    return state
+
+
+def post_etag(request, post_id):
+    state = _post_state(request, post_id)
+    if state is None:
+        return None
+    updated_at, posts_count, versions = state
+    return _etag(request, updated_at, posts_count, *versions)
+
+
+def post_last_modified(request, post_id):
+    state = _post_state(request, post_id)
+    if state is None:
+        return None
+    updated_at, _, versions = state
+    return max(updated_at, feed_last_modified(versions))
+
+
+post_condition = {'etag_func': post_etag,
+                  'last_modified_func': post_last_modified}
@@ -0,0 +1,225 @@
+from django.conf import settings
+from django.db import connection
+
+from .caching import bump_feeds, follow_scope, profile_scope, pulled_scope
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginators import FeedSource
+
+# Сколько лент обрезать одним запросом; заодно размер пачки вставки.
+TRIM_BATCH = 500
+
+
+def is_pulled(author_id):
+    """Посты авторов с большим числом подписчиков читаются при запросе."""
+    if settings.FEED_PULL_THRESHOLD is None:
+        return False
+    return UserStats.objects.filter(user=author_id,
+                                    feed_pulled=True).exists()
+
+
+def update_pull_state(author_id):
+    """Переводит автора между раскладкой и чтением при запросе.
+
+    Решение по живому счётчику теряло посты: написанные, пока автор
+    читался при запросе, не раскладывались, и после возврата в раскладку
+    пропадали из лент. Поэтому флаг feed_pulled меняется только здесь и
+    вместе с лентами: при переходе в чтение разложенное убирается, при
+    возврате последние FEED_TIMELINE_LENGTH постов раскладываются всем
+    подписчикам. Обратно автор возвращается с гистерезисом
+    FEED_PULL_HYSTERESIS.
+    """
+    threshold = settings.FEED_PULL_THRESHOLD
+    if threshold is None:
+        return
+    stats = UserStats.objects.filter(user=author_id)
+    count = stats.values_list('followers_count', flat=True).first()
+    if count is None:
+        return
+    # Флаг сдвигает условный UPDATE: переносит ленты один из воркеров.
+    if count >= threshold:
+        if stats.filter(feed_pulled=False).update(feed_pulled=True):
+            TimelineEntry.objects.filter(author=author_id).delete()
+            _bump_followers(author_id)
+    elif count < threshold * settings.FEED_PULL_HYSTERESIS:
+        if stats.filter(feed_pulled=True).update(feed_pulled=False):
+            _push_author(author_id)
+            _bump_followers(author_id)
+
+
+def _bump_followers(author_id):
+    # Переход бывает редко, а подписчики меняют источник ленты.
+    bump_feeds(profile_scope(author_id), pulled_scope(),
+               *map(follow_scope, Follow.objects.filter(
+                   author=author_id).values_list('user', flat=True)))
+
+
+def _push_author(author_id):
+    """Раскладывает последние посты автора всем его подписчикам."""
+    with connection.cursor() as cursor:
+        # WHERE обязателен: без него SQLite путает ON CONFLICT с JOIN ON.
+        cursor.execute(
+            f'INSERT INTO {TimelineEntry._meta.db_table} '
+            f'(user_id, post_id, author_id, pub_date) '
+            f'SELECT follow.user_id, post.id, post.author_id, post.pub_date '
+            f'FROM {Follow._meta.db_table} AS follow '
+            f'JOIN (SELECT id, author_id, pub_date '
+            f'FROM {Post._meta.db_table} WHERE author_id = %s '
+            f'ORDER BY pub_date DESC, id DESC LIMIT %s) AS post '
+            f'ON post.author_id = follow.author_id '
+            f'WHERE follow.author_id = %s '
+            f'ON CONFLICT (user_id, post_id) DO NOTHING',
+            [author_id, settings.FEED_TIMELINE_LENGTH, author_id])
+    trim_timelines(Follow.objects.filter(
+        author=author_id).values_list('user', flat=True))
+
+
+def reset_pull_state():
+    """Ставит флаги по счётчикам, не трогая ленты.
+
+    Для массовой загрузки, где ленты строятся после.
+    """
+    threshold = settings.FEED_PULL_THRESHOLD
+    UserStats.objects.update(feed_pulled=False)
+    if threshold is not None:
+        UserStats.objects.filter(followers_count__gte=threshold).update(
+            feed_pulled=True)
+
+
+def _entries(user_ids, posts):
+    return [TimelineEntry(user_id=user_id, post=post,
+                          author_id=post.author_id, pub_date=post.pub_date)
+            for user_id in user_ids for post in posts]
+
+
+def follower_ids(author_id):
+    """Подписчики, в ленты которых раскладываются посты автора."""
+    if is_pulled(author_id):
+        return []
+    return list(Follow.objects.filter(
+        author=author_id).values_list('user', flat=True))
+
+
+def follow_scopes(author_id):
+    """Версии лент подписок, где видны посты автора.
+
+    Подписчиков раскладываемого автора меньше FEED_PULL_THRESHOLD, и их
+    ленты сдвигаются по одной; у популярных — общая pulled_scope.
+    """
+    if is_pulled(author_id):
+        return [pulled_scope()]
+    return [follow_scope(user_id) for user_id in Follow.objects.filter(
+        author=author_id).values_list('user', flat=True)]
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора.
+
+    Лента каждого подписчика выросла на запись, поэтому тут же и
+    обрезается: иначе ленты тех, кто их не открывает, росли бы без конца.
+    """
+    user_ids = follower_ids(post.author_id)
+    TimelineEntry.objects.bulk_create(
+        _entries(user_ids, [post]), batch_size=TRIM_BATCH,
+        ignore_conflicts=True)
+    trim_timelines(user_ids)
+
+
+def backfill_timeline(user_id, author_id):
+    """Добавляет в ленту последние посты автора, на которого подписались."""
+    if is_pulled(author_id):
+        return
+    posts = Post.objects.filter(author=author_id).only(
+        'pk', 'author', 'pub_date')[:settings.FEED_TIMELINE_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        _entries([user_id], posts), ignore_conflicts=True)
+    trim_timelines([user_id])
+
+
+def prune_timeline(user_id, author_id):
+    """Убирает из ленты посты автора после отписки."""
+    TimelineEntry.objects.filter(user=user_id, author=author_id).delete()
+
+
+def trim_timelines(user_ids):
+    """Обрезает ленты до FEED_TIMELINE_LENGTH самых свежих записей.
+
+    По одному DELETE на TRIM_BATCH пользователей: позиция записи
+    считается оконной функцией по индексу (user, pub_date, post).
+    """
+    table = TimelineEntry._meta.db_table
+    user_ids = list(user_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(user_ids), TRIM_BATCH):
+            batch = user_ids[start:start + TRIM_BATCH]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                f'DELETE FROM {table} WHERE id IN ('
+                f'SELECT id FROM (SELECT id, row_number() OVER ('
+                f'PARTITION BY user_id '
+                f'ORDER BY pub_date DESC, post_id DESC) AS position '
+                f'FROM {table} WHERE user_id IN ({placeholders})) '
+                f'WHERE position > %s)',
+                [*batch, settings.FEED_TIMELINE_LENGTH])
+
+
+def timeline(user):
+    """Лента подписок: один проход по индексу (user, pub_date, post)."""
+    return TimelineEntry.objects.filter(user=user).select_related(
+        'post__author', 'post__group')
+
+
+def pulled_authors(user):
+    """Авторы подписок, чьи посты читаются при запросе."""
+    if settings.FEED_PULL_THRESHOLD is None:
+        return []
+    return list(Follow.objects.filter(
+        user=user, author__stats__feed_pulled=True,
+    ).values_list('author', flat=True))
+
+
+def feed_sources(user, pulled):
+    """Источники ленты подписок для MergedKeysetPaginator.
+
+    Разложенная заранее лента плюс по источнику на каждого популярного
+    автора из pulled, чьи посты читаются по индексу автора.
+    """
+    sources = [FeedSource(
+        timeline(user), ('pub_date', 'post_id'),
+        lambda entries: [entry.post for entry in entries])]
+    for author_id in pulled:
+        sources.append(FeedSource(
+            Post.objects.filter(author=author_id).select_related(
+                'author', 'group'),
+            ('pub_date', 'id'), None))
+    return sources
+
+
+def rebuild_timelines():
+    """Заполняет ленты всех подписчиков одним INSERT ... SELECT.
+
+    Для массовой загрузки, где сигналы не срабатывали: флаги авторов
+    ставятся по счётчикам (reset_pull_state), и в каждую ленту попадают
+    последние FEED_TIMELINE_LENGTH постов авторов, которых не читают при
+    запросе. Уже разложенное не дублируется.
+    """
+    reset_pull_state()
+    pulled = ''
+    if settings.FEED_PULL_THRESHOLD is not None:
+        pulled = (f'JOIN {UserStats._meta.db_table} AS stats '
+                  f'ON stats.user_id = follow.author_id '
+                  f'AND NOT stats.feed_pulled')
+    params = [settings.FEED_TIMELINE_LENGTH]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {TimelineEntry._meta.db_table} '
+            f'(user_id, post_id, author_id, pub_date) '
+            f'SELECT user_id, post_id, author_id, pub_date FROM ('
+            f'SELECT follow.user_id, post.id AS post_id, post.author_id, '
+            f'post.pub_date, row_number() OVER ('
+            f'PARTITION BY follow.user_id '
+            f'ORDER BY post.pub_date DESC, post.id DESC) AS position '
+            f'FROM {Follow._meta.db_table} AS follow {pulled} '
+            f'JOIN {Post._meta.db_table} AS post '
+            f'ON post.author_id = follow.author_id) '
+            f'WHERE position <= %s '
+            f'ON CONFLICT (user_id, post_id) DO NOTHING', params)
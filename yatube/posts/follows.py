@@ -0,0 +1,61 @@
+"""Подписки: одна запись в базу на действие и всё, что от неё зависит.
+
+follow() и unfollow() пишут сырым SQL, чтобы повтор и гонка двух
+одновременных кликов упирались в уникальный индекс (user, author), а не
+в проверку перед записью. Сигналы при этом не срабатывают, поэтому
+счётчики, ленты и версии кэша двигают followed() и unfollowed() — те же,
+что вызывают сигналы при работе через ORM.
+"""
+from django.db import connection, transaction
+
+from .caching import bump_feeds, follow_scope, profile_scope
+from .counters import bump_user
+from .feeds import backfill_timeline, prune_timeline, update_pull_state
+from .models import Follow
+
+TABLE = Follow._meta.db_table
+
+
+def followed(user_id, author_id):
+    bump_user(author_id, 'followers_count', 1)
+    bump_user(user_id, 'following_count', 1)
+    update_pull_state(author_id)
+    backfill_timeline(user_id, author_id)
+    bump_feeds(follow_scope(user_id), profile_scope(author_id))
+
+
+def unfollowed(user_id, author_id):
+    bump_user(author_id, 'followers_count', -1)
+    bump_user(user_id, 'following_count', -1)
+    prune_timeline(user_id, author_id)
+    update_pull_state(author_id)
+    bump_feeds(follow_scope(user_id), profile_scope(author_id))
+
+
+@transaction.atomic
+def follow(user_id, author_id):
+    """Подписывает; True, если подписки ещё не было."""
+    if user_id == author_id:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {TABLE} (user_id, author_id) VALUES (%s, %s) '
+            f'ON CONFLICT (user_id, author_id) DO NOTHING',
+            [user_id, author_id])
+        created = cursor.rowcount == 1
+    if created:
+        followed(user_id, author_id)
+    return created
+
+
+@transaction.atomic
+def unfollow(user_id, author_id):
+    """Отписывает; True, если подписка была."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE user_id = %s AND author_id = %s',
+            [user_id, author_id])
+        deleted = cursor.rowcount == 1
+    if deleted:
+        unfollowed(user_id, author_id)
+    return deleted
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from .images import normalize
 from .models import Post, Comment
 
 
@@ -12,6 +14,25 @@ class PostForm(forms.ModelForm):
             'text': forms.Textarea(),
         }
 
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        # Новый файл, а не текущая картинка поста и не её удаление.
+        if not isinstance(image, UploadedFile):
+            return image
+        self.normalized = normalize(image)
+        return self.normalized.file
+
+    def save(self, commit=True):
+        normalized = getattr(self, 'normalized', None)
+        if normalized is not None:
+            self.instance.image_width = normalized.width
+            self.instance.image_height = normalized.height
+            self.instance.image_bytes = normalized.bytes
+        elif not self.instance.image:
+            self.instance.image_width = self.instance.image_height = None
+            self.instance.image_bytes = None
+        return super().save(commit)
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,219 @@
+import re
+import statistics
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from posts.feeds import backfill_timeline
+from posts.models import Comment, Follow, Group, Post, UserStats
+from posts.urls import urlpatterns
+
+User = get_user_model()
+
+NO_CACHE = {
+    alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    for alias in ('default', 'shared')
+}
+FULL_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+TEMP_SORT_RE = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)')
+FROM_RE = re.compile(r'FROM "(\w+)"')
+EQUALS_RE = re.compile(r'"(\w+)"\."(\w+)" (?:= (?!")|IN \()')
+ORDER_RE = re.compile(r'ORDER BY (.+?)(?: LIMIT| OFFSET|\)|$)')
+ORDER_TERM_RE = re.compile(r'"(\w+)"\."(\w+)"( DESC)?')
+
+
+class Rollback(Exception):
+    pass
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def problems(plan):
+    """Полные просмотры таблиц и сортировки во временном B-дереве."""
+    found = []
+    for line in plan:
+        scan = FULL_SCAN_RE.match(line)
+        if scan:
+            found.append(('scan', scan.group(1)))
+        elif TEMP_SORT_RE.search(line):
+            found.append(('sort', None))
+    return found
+
+
+def propose_index(sql, table):
+    """Составной индекс: сначала равенства по table, затем ORDER BY."""
+    columns = []
+    for owner, column in EQUALS_RE.findall(sql):
+        if owner == table and column not in columns:
+            columns.append(column)
+    order = ORDER_RE.search(sql)
+    if order:
+        for owner, column, desc in ORDER_TERM_RE.findall(order.group(1)):
+            if owner == table and column not in columns:
+                columns.append(column + desc)
+    if not columns:
+        return None
+    return table, tuple(columns)
+
+
+def is_covered(table, columns):
+    """Есть ли индекс, который начинается с тех же столбцов."""
+    names = [column.split()[0] for column in columns]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor,
+                                                               table)
+    return any(constraint['index']
+               and constraint['columns'][:len(names)] == names
+               for constraint in constraints.values())
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет все URL из posts.urls на сгенерированных данных, '
+            'собирает EXPLAIN QUERY PLAN каждого запроса, отмечает полные '
+            'просмотры и временные сортировки и предлагает составные '
+            'индексы. Данные откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=20,
+                            help='Комментариев к каждому сотому посту.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Сколько раз открывать каждый URL.')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Печатать планы всех запросов.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(CACHES=NO_CACHE):
+                reader, kwargs = self.seed(options)
+                proposals = {}
+                for pattern in urlpatterns:
+                    self.check_url(pattern, kwargs, reader, options,
+                                   proposals)
+                self.report_proposals(proposals)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def check_url(self, pattern, kwargs, reader, options, proposals):
+        missing = set(pattern.pattern.converters) - set(kwargs)
+        if missing:
+            # Например, подписанный URL картинки: запросов к БД он не
+            # делает, а аргументы для него из данных не собрать.
+            self.stdout.write(f'{pattern.name}: пропущен, нет '
+                              f'{", ".join(sorted(missing))}')
+            return
+        url = reverse(f'posts:{pattern.name}', kwargs={
+            name: kwargs[name] for name in pattern.pattern.converters})
+        if pattern.name == 'search':
+            url += '?q=пост'
+        # Подписка — единственный GET с записью: откатываем каждый раз.
+        request = RequestFactory().get(url)
+        request.user = reader
+        match = resolve(request.path_info)
+        timings, sql_timings = [], []
+        for _ in range(options['repeat']):
+            sid = transaction.savepoint()
+            # Журнал запросов ограничен 9000 записями: наполнение
+            # данными его переполняет, и захват видел бы пустоту.
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                match.func(request, *match.args, **match.kwargs)
+                timings.append((time.perf_counter() - started) * 1000)
+            sql_timings.append(1000 * sum(
+                float(query['time']) for query in queries.captured_queries))
+            plans = [(query['sql'], explain(query['sql']))
+                     for query in queries.captured_queries
+                     if query['sql'].startswith(('SELECT', 'UPDATE',
+                                                 'DELETE'))]
+            transaction.savepoint_rollback(sid)
+        self.stdout.write(f'{url}: запросов {len(queries)}, '
+                          f'p50 {statistics.median(timings):.2f} мс, '
+                          f'из них SQL '
+                          f'{statistics.median(sql_timings):.2f} мс')
+        for sql, plan in plans:
+            found = problems(plan)
+            if not found and not options['verbose_plans']:
+                continue
+            self.stdout.write(f'  {" ".join(sql.split())[:200]}')
+            for line in plan:
+                self.stdout.write(f'    {line}')
+            for kind, table in found:
+                if table is None:
+                    # Сортировку делает внешний запрос по первой таблице.
+                    first = FROM_RE.search(sql)
+                    table = first and first.group(1)
+                index = table and propose_index(sql, table)
+                label = ('полный просмотр' if kind == 'scan'
+                         else 'сортировка во временном B-дереве')
+                self.stdout.write(self.style.WARNING(f'    ! {label}'))
+                if index:
+                    proposals.setdefault(index, set()).add(url)
+
+    def report_proposals(self, proposals):
+        if not proposals:
+            self.stdout.write(self.style.SUCCESS('Индексы не нужны'))
+            return
+        self.stdout.write('Предлагаемые индексы:')
+        for (table, columns), urls in sorted(proposals.items()):
+            if is_covered(table, columns):
+                # Индекс есть, но планировщик счёл просмотр дешевле.
+                self.stdout.write(f'  {table} ({", ".join(columns)}): '
+                                  f'индекс уже есть, проверьте ANALYZE')
+                continue
+            name = '_'.join(column.split()[0] for column in columns)
+            self.stdout.write(
+                f'  CREATE INDEX {table}_{name}_idx ON {table} '
+                f'({", ".join(columns)});  -- {", ".join(sorted(urls))}')
+
+    def seed(self, options):
+        # bulk_create в SQLite не возвращает pk, поэтому перечитываем.
+        User.objects.bulk_create(
+            User(username=f'advise_{i}') for i in range(options['users']))
+        users = list(User.objects.filter(username__startswith='advise_'))
+        UserStats.objects.bulk_create(
+            UserStats(user=user) for user in users)
+        Group.objects.bulk_create(
+            Group(title=f'Группа {i}', slug=f'advise-{i}', description='-')
+            for i in range(10))
+        groups = list(Group.objects.filter(slug__startswith='advise-'))
+        Post.objects.bulk_create(
+            (Post(author=users[i % len(users)], text=f'Пост {i}',
+                  group=groups[i % len(groups)] if i % 3 else None)
+             for i in range(options['posts'])),
+            batch_size=500)
+        posts = list(Post.objects.filter(author__in=users)
+                     .values_list('pk', flat=True)[::100])
+        Comment.objects.bulk_create(
+            (Comment(post_id=post_id, author=users[i % len(users)],
+                     text=f'Комментарий {i}')
+             for post_id in posts for i in range(options['comments'])),
+            batch_size=500)
+        reader, author = users[0], users[1]
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=user) for user in users[1::4])
+        for user in users[1::4]:
+            backfill_timeline(reader.pk, user.pk)
+        call_command('rebuild_counters', stdout=StringIO())
+        # Статистика для планировщика, как после ANALYZE на живой базе.
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        post = Post.objects.filter(author=reader).first()
+        return reader, {
+            'slug': groups[0].slug,
+            'username': author.username,
+            'post_id': post.pk,
+        }
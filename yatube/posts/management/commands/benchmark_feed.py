@@ -0,0 +1,100 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+
+from posts.feeds import backfill_timeline, reset_pull_state
+from posts.models import Follow, Post, TimelineEntry, UserStats
+from posts.views import follow_index
+
+User = get_user_model()
+
+MODES = (
+    ('push', None),
+    ('hybrid', 'threshold'),
+    ('pull', 0),
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает раскладку ленты при записи и чтение при запросе: '
+            'строк на пост и задержку follow_index. Данные откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, default=5000,
+                            help='Подписчиков у популярного автора.')
+        parser.add_argument('--authors', type=int, default=50,
+                            help='Обычных авторов в подписках читателя.')
+        parser.add_argument('--posts', type=int, default=20,
+                            help='Постов у каждого автора.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Сколько раз читать ленту.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"режим":<8}{"строк/пост":>12}'
+                          f'{"запись, мс":>12}{"чтение p50, мс":>16}')
+        for name, threshold in MODES:
+            if threshold == 'threshold':
+                threshold = options['followers']
+            try:
+                with transaction.atomic(), override_settings(
+                        FEED_PULL_THRESHOLD=threshold):
+                    self.run_mode(name, options)
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def run_mode(self, name, options):
+        reader, star = self.seed(options)
+        entries = TimelineEntry.objects.count()
+        started = time.perf_counter()
+        Post.objects.create(author=star, text='Новый пост')
+        write_ms = (time.perf_counter() - started) * 1000
+        amplification = TimelineEntry.objects.count() - entries
+
+        request = RequestFactory().get(reverse('posts:follow_index'))
+        request.user = reader
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            follow_index(request)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(f'{name:<8}{amplification:>12}{write_ms:>12.1f}'
+                          f'{timings[len(timings) // 2]:>16.2f}')
+
+    def seed(self, options):
+        # bulk_create в SQLite не возвращает pk, поэтому перечитываем.
+        User.objects.bulk_create(
+            User(username=f'bench_follower_{i}')
+            for i in range(options['followers']))
+        User.objects.bulk_create(
+            User(username=f'bench_author_{i}')
+            for i in range(options['authors']))
+        users = list(User.objects.filter(username__startswith='bench_'))
+        star = User.objects.create_user('bench_star')
+        followers = [u for u in users if 'follower' in u.username]
+        authors = [u for u in users if 'author' in u.username]
+        reader = followers[0]
+        UserStats.objects.bulk_create(UserStats(user=user) for user in users)
+        UserStats.objects.filter(user=star).update(
+            followers_count=len(followers))
+        Follow.objects.bulk_create(
+            Follow(user=user, author=star) for user in followers)
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author) for author in authors)
+        Post.objects.bulk_create(
+            Post(author=author, text=f'Пост {i}')
+            for author in authors + [star]
+            for i in range(options['posts']))
+        reset_pull_state()
+        for author in authors + [star]:
+            backfill_timeline(reader.pk, author.pk)
+        return reader, star
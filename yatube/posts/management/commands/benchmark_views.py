@@ -0,0 +1,195 @@
+import json
+import platform
+import time
+from io import StringIO
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Group, Post, UserStats
+
+# Наборы данных для seed_yatube.
+SIZES = {
+    'small': {'users': 200, 'posts': 2000, 'comments': 2000,
+              'groups': 10, 'follows': 20},
+    'medium': {'users': 2000, 'posts': 50000, 'comments': 50000,
+               'groups': 30, 'follows': 30},
+    'large': {'users': 20000, 'posts': 500000, 'comments': 500000,
+              'groups': 50, 'follows': 40},
+}
+NO_CACHE = {
+    alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    for alias in ('default', 'shared')
+}
+LOCAL_CACHE = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': f'benchmark-{alias}'}
+    for alias in ('default', 'shared')
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(values, percent):
+    """Перцентиль с интерполяцией между соседними значениями.
+
+    То же, что statistics.quantiles(method='inclusive'), которого нет
+    в Python 3.7.
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * percent / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+class Command(BaseCommand):
+    help = ('Гоняет основные страницы через тестовый клиент на наборах '
+            'данных разного размера: p50/p95/p99, число SQL-запросов и '
+            'размер ответа. Результат пишется в JSON и сравнивается с '
+            'базовым. Данные откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='small,medium',
+                            help=f'Через запятую из {", ".join(SIZES)}.')
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Запросов на каждую страницу.')
+        parser.add_argument('--output', help='Куда записать JSON.')
+        parser.add_argument('--baseline',
+                            help='JSON прошлого прогона для сравнения.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый рост p95, доля.')
+        parser.add_argument('--cache', action='store_true',
+                            help='Мерить с кэшем в памяти процесса, '
+                                 'а не без кэша.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        sizes = options['sizes'].split(',')
+        unknown = set(sizes) - set(SIZES)
+        if unknown:
+            raise CommandError(f'Неизвестные размеры: {", ".join(unknown)}')
+        results = {}
+        caches = LOCAL_CACHE if options['cache'] else NO_CACHE
+        for size in sizes:
+            try:
+                with transaction.atomic(), override_settings(CACHES=caches):
+                    results[size] = self.run_size(size, options)
+                    raise Rollback
+            except Rollback:
+                pass
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'sqlite': connection.Database.sqlite_version,
+                'repeat': options['repeat'],
+                'cache': options['cache'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['threshold'])
+
+    def run_size(self, size, options):
+        self.stdout.write(f'{size}: наполнение...')
+        call_command('seed_yatube', prefix=f'bench{size}',
+                     seed=options['seed'], stdout=StringIO(), **SIZES[size])
+        client = Client()
+        scenarios = self.scenarios(size, client)
+        self.stdout.write(f'{"страница":<14}{"p50, мс":>9}{"p95, мс":>9}'
+                          f'{"p99, мс":>9}{"SQL":>6}{"байт":>9}')
+        results = {}
+        for name, request in scenarios:
+            results[name] = self.measure(request, options['repeat'])
+            row = results[name]
+            self.stdout.write(
+                f'{name:<14}{row["p50_ms"]:>9.2f}{row["p95_ms"]:>9.2f}'
+                f'{row["p99_ms"]:>9.2f}{row["queries"]:>6}{row["bytes"]:>9}')
+        return results
+
+    def scenarios(self, size, client):
+        prefix = f'bench{size}'
+        stats = UserStats.objects.filter(user__username__startswith=prefix)
+        author = stats.order_by('-posts_count').first().user
+        reader = stats.order_by('-following_count').first().user
+        group = Group.objects.filter(slug__startswith=prefix).annotate(
+            total=Count('posts')).order_by('-total').first()
+        post = Post.objects.filter(author__username__startswith=prefix) \
+            .order_by('-comments_count').first()
+        client.force_login(reader)
+        return (
+            ('index', lambda: client.get(reverse('posts:index'))),
+            ('group_posts', lambda: client.get(
+                reverse('posts:group_list', args=[group.slug]))),
+            ('profile', lambda: client.get(
+                reverse('posts:profile', args=[author.username]))),
+            ('post_detail', lambda: client.get(
+                reverse('posts:post_detail', args=[post.pk]))),
+            ('follow_index', lambda: client.get(
+                reverse('posts:follow_index'))),
+            ('post_create', lambda: client.post(
+                reverse('posts:post_create'),
+                {'text': 'Пост из бенчмарка', 'group': group.pk})),
+            ('add_comment', lambda: client.post(
+                reverse('posts:add_comment', args=[post.pk]),
+                {'text': 'Комментарий из бенчмарка'})),
+        )
+
+    def measure(self, request, repeat):
+        timings, queries = [], []
+        size = 0
+        for _ in range(repeat):
+            # Журнал запросов ограничен 9000 записями, а наполнение его
+            # переполняет.
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request()
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise CommandError(f'{response.status_code} от '
+                                   f'{response.request["PATH_INFO"]}')
+            queries.append(len(captured))
+            size = len(response.content)
+        return {
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'queries': max(queries),
+            'bytes': size,
+        }
+
+    def compare(self, report, path, threshold):
+        """Рост p95 больше threshold или новые запросы — регрессия."""
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = []
+        for size, views in report['results'].items():
+            for name, row in views.items():
+                old = baseline.get(size, {}).get(name)
+                if old is None:
+                    continue
+                if row['p95_ms'] > old['p95_ms'] * (1 + threshold):
+                    regressions.append(
+                        f'{size}/{name}: p95 {old["p95_ms"]:.2f} → '
+                        f'{row["p95_ms"]:.2f} мс')
+                if row['queries'] > old['queries']:
+                    regressions.append(
+                        f'{size}/{name}: запросов {old["queries"]} → '
+                        f'{row["queries"]}')
+        if regressions:
+            raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts.counters import actual_comment_counts, actual_user_counts
+from posts.models import Post, UserStats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов, подписок и комментариев.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сверить счётчики, ничего не меняя.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            wrong_users = self.sync_users(options['check'])
+            wrong_posts = self.sync_posts(options['check'])
+        message = (f'Расхождений: пользователи {wrong_users}, '
+                   f'посты {wrong_posts}')
+        if options['check'] and (wrong_users or wrong_posts):
+            raise CommandError(message)
+        self.stdout.write(message)
+
+    def sync_users(self, check):
+        actual = actual_user_counts()
+        stored = {stats.user_id: stats for stats in UserStats.objects.all()}
+        wrong = []
+        for user_id, counts in actual.items():
+            stats = stored.get(user_id) or UserStats(user_id=user_id)
+            if all(getattr(stats, field) == value
+                   for field, value in counts.items()):
+                continue
+            for field, value in counts.items():
+                setattr(stats, field, value)
+            wrong.append(stats)
+        if not check:
+            UserStats.objects.bulk_create(
+                [stats for stats in wrong if stats.pk is None])
+            UserStats.objects.bulk_update(
+                [stats for stats in wrong if stats.pk is not None],
+                ['posts_count', 'followers_count', 'following_count'],
+                batch_size=500)
+        return len(wrong)
+
+    def sync_posts(self, check):
+        actual = actual_comment_counts()
+        wrong = []
+        rows = Post.objects.values_list('pk', 'comments_count').order_by()
+        for pk, stored in rows.iterator():
+            value = actual.get(pk, 0)
+            if stored != value:
+                wrong.append(Post(pk=pk, comments_count=value))
+        if not check:
+            Post.objects.bulk_update(wrong, ['comments_count'],
+                                     batch_size=500)
+        return len(wrong)
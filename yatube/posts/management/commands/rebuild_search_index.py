@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает индексы полнотекстового поиска.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сверить индексы с таблицами, ничего не меняя.')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            broken = search.integrity_errors()
+            if broken:
+                raise CommandError(f'Разошлись с таблицами: '
+                                   f'{", ".join(broken)}')
+            self.stdout.write('Индексы в порядке')
+            return
+        search.rebuild()
+        self.stdout.write('Индексы перестроены')
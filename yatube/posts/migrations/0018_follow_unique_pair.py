@@ -0,0 +1,36 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:20
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    # Дубликаты посчитаны в счётчиках (и сигналами, и 0013_counters),
+    # поэтому вместе со строками убираем и их вклад.
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    pairs = Follow.objects.values('user', 'author').annotate(
+        first=Min('pk'), total=Count('pk')).filter(total__gt=1).order_by()
+    for pair in pairs:
+        extra = pair['total'] - 1
+        Follow.objects.filter(user=pair['user'], author=pair['author']).exclude(
+            pk=pair['first']).delete()
+        UserStats.objects.filter(user=pair['author']).update(
+            followers_count=F('followers_count') - extra)
+        UserStats.objects.filter(user=pair['user']).update(
+            following_count=F('following_count') - extra)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='follow_unique_pair'),
+        ),
+    ]
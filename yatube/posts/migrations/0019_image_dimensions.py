@@ -0,0 +1,45 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:50
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+from posts.images import dimensions
+
+
+def fill_dimensions(apps, schema_editor):
+    # Уже загруженные картинки не пережимаются: только узнаём размеры.
+    Post = apps.get_model('posts', 'Post')
+    names = Post.objects.exclude(image='').order_by().values_list(
+        'image', flat=True).distinct()
+    for name in names.iterator():
+        found = dimensions(name, default_storage)
+        if found is not None:
+            width, height, size = found
+            Post.objects.filter(image=name).update(
+                image_width=width, image_height=height, image_bytes=size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_follow_unique_pair'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_bytes',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Размер картинки, байт'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.RunPython(fill_dimensions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pulled(apps, schema_editor):
+    # Раньше решалось по живому счётчику: фиксируем то же состояние, а
+    # разложенное до перехода убираем, как это делает update_pull_state.
+    threshold = settings.FEED_PULL_THRESHOLD
+    if threshold is None:
+        return
+    UserStats = apps.get_model('posts', 'UserStats')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    pulled = UserStats.objects.filter(followers_count__gte=threshold)
+    pulled.update(feed_pulled=True)
+    TimelineEntry.objects.filter(
+        author__in=pulled.values('user')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='feed_pulled',
+            field=models.BooleanField(default=False, verbose_name='Ленту читают при запросе'),
+        ),
+        migrations.RunPython(mark_pulled, migrations.RunPython.noop),
+    ]
@@ -7,6 +7,8 @@ User = get_user_model()
 class Post(models.Model):
     text = models.TextField(verbose_name='Текст', help_text='Введите текст')
     pub_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True,
+                                      verbose_name='Изменён')
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -24,6 +26,16 @@ class Post(models.Model):
         blank=True,
         help_text='Поле изображения'
     )
+    # Заполняет приём картинки (posts.images), чтобы размер не узнавать
+    # открытием файла.
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки', null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(
+        'Высота картинки', null=True, blank=True, editable=False)
+    image_bytes = models.PositiveIntegerField(
+        'Размер картинки, байт', null=True, blank=True, editable=False)
+    comments_count = models.PositiveIntegerField(
+        'Комментариев', default=0, editable=False)
 
     def __str__(self) -> str:
         return self.text
@@ -32,6 +44,15 @@ class Post(models.Model):
         ordering = ('-pub_date',)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Ленты листаются по ключу (pub_date, id), см. posts.paginators.
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_date_idx'),
+        ]
 
 
 class Group(models.Model):
@@ -65,3 +86,47 @@ class Follow(models.Model):
                              related_name='follower')
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='following')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='follow_unique_pair'),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые ведут сигналы из posts.signals."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                related_name='stats')
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+    # Меняется только в posts.feeds.update_pull_state вместе с лентами.
+    feed_pulled = models.BooleanField('Ленту читают при запросе',
+                                      default=False)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+
+class TimelineEntry(models.Model):
+    """Пост в материализованной ленте подписок пользователя."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ('-pub_date', '-post')
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='timeline_unique_post'),
+        ]
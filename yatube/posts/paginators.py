@@ -0,0 +1,300 @@
+import base64
+import binascii
+import heapq
+import math
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+
+from . import search
+from .models import Post
+
+
+PageLink = namedtuple('PageLink', ('number', 'query'))
+FeedSource = namedtuple('FeedSource', ('queryset', 'keys', 'transform'))
+
+
+def encode_cursor(values, number):
+    """Упаковывает ключ (pub_date или score, id) и номер страницы в токен."""
+    first, pk = values
+    if isinstance(first, datetime):
+        first = first.isoformat()
+    raw = f'{first}|{pk}|{number}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def parse_score(value):
+    score = float(value)
+    return score if math.isfinite(score) else None
+
+
+def decode_cursor(token, parse=parse_datetime):
+    """Распаковывает токен курсора, на мусор возвращает None."""
+    try:
+        padding = '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(token + padding).decode()
+        first, pk, number = raw.split('|')
+        first = parse(first)
+        if first is None:
+            return None
+        return (first, int(pk)), max(int(number), 1)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def seek(queryset, keys, values=None, descending=True):
+    """Упорядочивает выборку по паре ключей и отрезает всё до values."""
+    prefix = '-' if descending else ''
+    queryset = queryset.order_by(*(prefix + key for key in keys))
+    if values is None:
+        return queryset
+    first, second = keys
+    lookup = 'lt' if descending else 'gt'
+    return queryset.filter(
+        Q(**{f'{first}__{lookup}': values[0]})
+        | Q(**{first: values[0], f'{second}__{lookup}': values[1]}))
+
+
+def _unique(objects):
+    seen = set()
+    for obj in objects:
+        if obj.pk not in seen:
+            seen.add(obj.pk)
+            yield obj
+
+
+class KeysetPaginator(Paginator):
+    """Пагинатор по ключу (pub_date, id) без OFFSET и COUNT(*).
+
+    Страница ищется условием по ключу последней записи предыдущей
+    страницы, поэтому глубокие страницы стоят столько же, сколько первая.
+    Старые ссылки ?page=N обслуживаются через OFFSET, но только до
+    PAGINATOR_MAX_OFFSET_PAGE. Общее число страниц считается только при
+    show_total.
+    """
+
+    ELLIPSIS = '…'
+    parse_key = staticmethod(parse_datetime)
+
+    def __init__(self, object_list, per_page, keys=('pub_date', 'id'),
+                 max_offset_page=None, show_total=None):
+        super().__init__(object_list, per_page)
+        self.keys = keys
+        if max_offset_page is None:
+            max_offset_page = settings.PAGINATOR_MAX_OFFSET_PAGE
+        self.max_offset_page = max_offset_page
+        if show_total is None:
+            show_total = settings.PAGINATOR_SHOW_TOTAL
+        self.show_total = show_total
+
+    def validate_number(self, number):
+        # Без сравнения с num_pages: оно стоило бы COUNT(*).
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return 1
+        return min(max(number, 1), self.max_offset_page)
+
+    def get_key(self, obj):
+        return tuple(getattr(obj, key) for key in self.keys)
+
+    def _fetch(self, values=None, descending=True, offset=0):
+        queryset = seek(self.object_list, self.keys, values, descending)
+        return list(queryset[offset:offset + self.per_page + 1])
+
+    def _build_page(self, rows, number, has_previous, has_next):
+        page = self._get_page(rows, number, self)
+        page.previous_cursor = None
+        page.next_cursor = None
+        if rows and has_previous:
+            page.previous_cursor = encode_cursor(
+                self.get_key(rows[0]), number)
+        if rows and has_next:
+            page.next_cursor = encode_cursor(self.get_key(rows[-1]), number)
+        return page
+
+    def get_page(self, number):
+        """Страница по номеру (старые ссылки ?page=N и ?page=last)."""
+        if number == 'last':
+            return self.page_last()
+        number = self.validate_number(number)
+        rows = self._fetch(offset=(number - 1) * self.per_page)
+        if not rows and number > 1:
+            return self.get_page(1)
+        has_next = len(rows) > self.per_page
+        return self._build_page(rows[:self.per_page], number,
+                                number > 1, has_next)
+
+    def page_after(self, values, number):
+        """Страница, следующая за записью с ключом values."""
+        rows = self._fetch(values)
+        has_next = len(rows) > self.per_page
+        page = self._build_page(rows[:self.per_page], number + 1,
+                                True, has_next)
+        if not rows:
+            # Записи за курсором удалили: даём вернуться назад.
+            page.previous_cursor = encode_cursor(values, number + 1)
+        return page
+
+    def page_before(self, values, number):
+        """Страница, предшествующая записи с ключом values."""
+        rows = self._fetch(values, descending=False)
+        if not rows:
+            return self.get_page(1)
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page][::-1]
+        number = max(number - 1, 1)
+        if not has_previous:
+            number = 1
+        elif number == 1:
+            number = 2
+        return self._build_page(rows, number, has_previous, True)
+
+    def page_last(self):
+        """Последняя страница: выборка с конца, без OFFSET."""
+        number = self.num_pages
+        size = self.count - (number - 1) * self.per_page
+        rows = self._fetch(descending=False)[:size][::-1]
+        return self._build_page(rows, number, number > 1, False)
+
+    def _page_query(self, page, number):
+        if number == page.number - 1 and page.previous_cursor:
+            return f'before={page.previous_cursor}'
+        if number == page.number + 1 and page.next_cursor:
+            return f'after={page.next_cursor}'
+        if self.show_total and number == self.num_pages:
+            return 'page=last'
+        if number <= self.max_offset_page:
+            return f'page={number}'
+        return None
+
+    def get_elided_page_range(self, page, on_each_side=2, on_ends=1):
+        """Окно номеров вокруг текущей страницы с пропусками.
+
+        Возвращает список PageLink(number, query); пропуск обозначается
+        номером ELLIPSIS. Без show_total вперёд видна только следующая
+        страница, а последняя не показывается вовсе.
+        """
+        current = page.number
+        if self.show_total:
+            last = self.num_pages
+        else:
+            last = current + 1 if page.next_cursor else current
+        numbers = set(range(1, on_ends + 1))
+        numbers.update(range(current - on_each_side,
+                             current + on_each_side + 1))
+        if self.show_total:
+            numbers.update(range(last - on_ends + 1, last + 1))
+        links = []
+        for number in sorted(n for n in numbers if 1 <= n <= last):
+            query = '' if number == current else self._page_query(
+                page, number)
+            if query is None:
+                continue
+            if links and number - links[-1].number > 1:
+                links.append(PageLink(self.ELLIPSIS, None))
+            links.append(PageLink(number, query))
+        return links
+
+    def get_page_from_request(self, request):
+        """Разбирает ?after=, ?before= и ?page= из запроса."""
+        for param, method in (('after', self.page_after),
+                              ('before', self.page_before)):
+            token = request.GET.get(param)
+            if token:
+                cursor = decode_cursor(token, self.parse_key)
+                if cursor is not None:
+                    return method(*cursor)
+        return self.get_page(request.GET.get('page'))
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """Пагинатор поверх нескольких упорядоченных источников.
+
+    object_list — список FeedSource. Каждый источник отдаёт не больше
+    страницы строк по своему индексу, transform превращает их в объекты
+    с общим ключом keys, а heapq.merge сливает потоки в один. Объекты с
+    одинаковым pk попадают на страницу один раз.
+    """
+
+    @cached_property
+    def count(self):
+        return sum(source.queryset.count() for source in self.object_list)
+
+    def _stream(self, source, values, descending, limit):
+        queryset = seek(source.queryset, source.keys, values, descending)
+        rows = list(queryset[:limit])
+        if source.transform is not None:
+            rows = source.transform(rows)
+        return rows
+
+    def _fetch(self, values=None, descending=True, offset=0):
+        limit = offset + self.per_page + 1
+        streams = [self._stream(source, values, descending, limit)
+                   for source in self.object_list]
+        merged = heapq.merge(*streams, key=self.get_key, reverse=descending)
+        return list(islice(_unique(merged), offset, limit))
+
+
+class SearchPaginator(KeysetPaginator):
+    """Пагинатор выдачи поиска по ключу (score, id).
+
+    object_list — запрос FTS5 (search.match_query). Порядок задаёт
+    релевантность, поэтому выборка идёт сырым SQL по индексам, а посты
+    подтягиваются одним запросом по id и получают атрибуты score,
+    text_highlight и comment_highlight.
+    """
+
+    parse_key = staticmethod(parse_score)
+
+    def __init__(self, object_list, per_page, **kwargs):
+        kwargs.setdefault('keys', ('score', 'id'))
+        super().__init__(object_list, per_page, **kwargs)
+
+    def _params(self):
+        query = self.object_list
+        return [query, search.COMMENT_WEIGHT, query]
+
+    @cached_property
+    def count(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM ({search.HITS})',
+                           self._params())
+            return cursor.fetchone()[0]
+
+    def _fetch(self, values=None, descending=True, offset=0):
+        params = self._params()
+        where = ''
+        if values is not None:
+            op = '<' if descending else '>'
+            where = (f'WHERE score {op} %s '
+                     f'OR (score = %s AND post_id {op} %s)')
+            params += [values[0], values[0], values[1]]
+        order = 'DESC' if descending else 'ASC'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT post_id, score FROM ({search.HITS}) {where} '
+                f'ORDER BY score {order}, post_id {order} '
+                f'LIMIT %s OFFSET %s',
+                params + [self.per_page + 1, offset])
+            scores = cursor.fetchall()
+        posts = (Post.objects.select_related('author', 'group')
+                 .in_bulk([pk for pk, _ in scores]))
+        marks = search.highlights(self.object_list, list(posts))
+        rows = []
+        for pk, score in scores:
+            post = posts.get(pk)
+            if post is None:
+                # Пост удалили между запросами.
+                continue
+            post.score = score
+            post.text_highlight, post.comment_highlight = marks[pk]
+            rows.append(post)
+        return rows
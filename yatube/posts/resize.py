@@ -0,0 +1,154 @@
+"""Картинки постов нужного размера по подписанному URL.
+
+Миниатюры sorl привязывают работу Pillow к рендеру HTML. Здесь страница
+только выводит URL вида /img/<подпись>/<ш>x<в>/<crop>/<имя картинки>,
+а картинку уменьшает сам запрос к нему, при первом обращении. Подпись
+не даёт заказать произвольный размер. Готовые картинки лежат в
+RESIZE_CACHE_DIR. Когда он вырастает больше RESIZE_CACHE_MAX_BYTES,
+удаляются давно не читанные (LRU по mtime). Одновременные запросы
+одного варианта, в том числе из разных воркеров, ждут первый под
+блокировкой в общем кэше, как в core.cache.stampede. Ответ кэшируется
+браузером и CDN на RESIZE_MAX_AGE: вариант по URL не меняется.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+
+from core.cache.stampede import WAIT_STEP
+
+from .images import resized
+
+SALT = 'posts.resize'
+CROPS = ('center', 'fit')
+PNG_MAGIC = b'\x89PNG'
+# mtime как время последнего чтения обновляется не чаще раза в минуту:
+# иначе каждое попадание было бы записью на диск.
+ACCESS_RESOLUTION = 60
+
+
+def _variant(name, width, height, crop):
+    return f'{width}x{height}/{crop}/{name}'
+
+
+def signature(name, width, height, crop):
+    return signing.Signer(salt=SALT).signature(
+        _variant(name, width, height, crop))
+
+
+def is_signed(value, name, width, height, crop):
+    return constant_time_compare(value,
+                                 signature(name, width, height, crop))
+
+
+def resize_url(name, width, height, crop='center'):
+    """Подписанный URL картинки name, уменьшенной до width×height."""
+    return reverse('posts:resized_image', args=[
+        signature(name, width, height, crop), width, height, crop, name])
+
+
+def cache_path(name, width, height, crop):
+    digest = hashlib.sha1(
+        _variant(name, width, height, crop).encode()).hexdigest()
+    return os.path.join(settings.RESIZE_CACHE_DIR, digest[:2], digest)
+
+
+def content_type(file):
+    is_png = file.read(len(PNG_MAGIC)) == PNG_MAGIC
+    file.seek(0)
+    return 'image/png' if is_png else 'image/jpeg'
+
+
+def _open(path):
+    """Открытый файл из кэша или None; отмечает чтение для LRU."""
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    # Открытый файл читается, даже если его тут же вытеснят.
+    now = time.time()
+    try:
+        if now - os.fstat(file.fileno()).st_mtime > ACCESS_RESOLUTION:
+            os.utime(path, (now, now))
+    except FileNotFoundError:
+        pass
+    return file
+
+
+def _store(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Через временный файл: читатели не увидят недописанную картинку.
+    # Точка в начале имени — чтобы evict его не трогал.
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.')
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+def evict(directory, limit):
+    """Удаляет давно не читанные картинки, пока их больше limit байт."""
+    entries = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.startswith('.'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Ту же картинку мог вытеснить соседний воркер.
+            pass
+        total -= size
+
+
+def render(name, width, height, crop):
+    """Открытый файл варианта; при первом запросе создаёт его.
+
+    Пока вариант создаёт один запрос, остальные ждут его до
+    CACHE_LOCK_TIMEOUT и только потом берутся за него сами.
+    """
+    path = cache_path(name, width, height, crop)
+    file = _open(path)
+    if file is not None:
+        return file
+    lock = f'resize:{os.path.basename(path)}'
+    lock_timeout = settings.CACHE_LOCK_TIMEOUT
+    deadline = time.time() + lock_timeout
+    while not cache.add(lock, 1, lock_timeout):
+        time.sleep(WAIT_STEP)
+        file = _open(path)
+        if file is not None:
+            return file
+        if time.time() >= deadline:
+            lock = None
+            break
+    try:
+        file = _open(path)
+        if file is not None:
+            return file
+        with default_storage.open(name) as source:
+            _store(path, resized(source, width, height, crop))
+        file = open(path, 'rb')
+        # Обход каталога дорог, но запись бывает один раз на вариант.
+        evict(settings.RESIZE_CACHE_DIR, settings.RESIZE_CACHE_MAX_BYTES)
+        return file
+    finally:
+        if lock is not None:
+            cache.delete(lock)
@@ -0,0 +1,183 @@
+"""Полнотекстовый поиск по постам и комментариям на SQLite FTS5.
+
+Индексы posts_post_fts и posts_comment_fts — external content: сами
+тексты лежат в posts_post и posts_comment, а FTS хранит только словарь
+и позиции. Синхронизацию держат триггеры, поэтому её не обходят ни
+bulk_create, ни QuerySet.update. Миграции Django в SQLite пересоздают
+таблицу при изменении полей и теряют триггеры, поэтому install()
+вызывается и после каждого migrate.
+"""
+import re
+
+from django.db import DatabaseError, connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# (индекс, таблица с текстами)
+INDEXES = (
+    ('posts_post_fts', 'posts_post'),
+    ('posts_comment_fts', 'posts_comment'),
+)
+
+SCHEMA = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+        text, content='{table}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table}
+    BEGIN
+        INSERT INTO {index} (rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table}
+    BEGIN
+        INSERT INTO {index} ({index}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {index}_update
+    AFTER UPDATE OF text ON {table}
+    BEGIN
+        INSERT INTO {index} ({index}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {index} (rowid, text) VALUES (new.id, new.text);
+    END""",
+)
+
+DROP = (
+    'DROP TRIGGER IF EXISTS {index}_insert',
+    'DROP TRIGGER IF EXISTS {index}_delete',
+    'DROP TRIGGER IF EXISTS {index}_update',
+    'DROP TABLE IF EXISTS {index}',
+)
+
+# Совпадение в комментарии весит меньше, чем в самом посте.
+COMMENT_WEIGHT = 0.5
+
+# Пост попадает в выдачу, если слова нашлись в нём или в его
+# комментариях; score — лучший из bm25 со знаком минус, чтобы, как и в
+# лентах, листать по убыванию ключа (score, id).
+HITS = '''
+SELECT post_id, -min(rank) AS score FROM (
+    SELECT rowid AS post_id, bm25(posts_post_fts) AS rank
+    FROM posts_post_fts WHERE posts_post_fts MATCH %s
+    UNION ALL
+    SELECT comment.post_id, bm25(posts_comment_fts) * %s
+    FROM posts_comment_fts
+    JOIN posts_comment AS comment ON comment.id = posts_comment_fts.rowid
+    WHERE posts_comment_fts MATCH %s
+) GROUP BY post_id
+'''
+
+# Маркеры подсветки из служебных символов: их нет в тексте, и они
+# переживают экранирование HTML.
+MARK_OPEN, MARK_CLOSE = '\x02', '\x03'
+
+WORD_RE = re.compile(r'\w+')
+
+
+def is_supported(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def install(using=connection):
+    """Создаёт недостающие индексы и триггеры."""
+    if not is_supported(using):
+        return
+    with using.cursor() as cursor:
+        # Не executescript: он коммитит открытую транзакцию.
+        for index, table in INDEXES:
+            for statement in SCHEMA:
+                cursor.execute(statement.format(index=index, table=table))
+
+
+def uninstall(using=connection):
+    if not is_supported(using):
+        return
+    with using.cursor() as cursor:
+        for index, _ in INDEXES:
+            for statement in DROP:
+                cursor.execute(statement.format(index=index))
+
+
+def rebuild(using=connection):
+    """Перестраивает индексы по текущему содержимому таблиц."""
+    install(using)
+    with using.cursor() as cursor:
+        for index, _ in INDEXES:
+            cursor.execute(
+                f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+            cursor.execute(
+                f"INSERT INTO {index} ({index}) VALUES ('optimize')")
+
+
+def integrity_errors(using=connection):
+    """Имена индексов, разошедшихся с таблицами."""
+    broken = []
+    with using.cursor() as cursor:
+        for index, _ in INDEXES:
+            try:
+                cursor.execute(
+                    f"INSERT INTO {index} ({index}, rank) "
+                    f"VALUES ('integrity-check', 1)")
+            except DatabaseError:
+                broken.append(index)
+    return broken
+
+
+def match_query(text):
+    """Строка пользователя в запрос FTS5: все слова, последнее — префикс.
+
+    Операторы FTS5 (кавычки, NEAR, OR, *) из ввода не пропускаются,
+    поэтому запрос не может оказаться синтаксически неверным.
+    """
+    words = WORD_RE.findall(text)[:16]
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def matching_ids(index, query):
+    """Подзапрос с rowid подходящих записей для фильтра id__in."""
+    return RawSQL(f'SELECT rowid FROM {index} WHERE {index} MATCH %s',
+                  (query,))
+
+
+def _mark(text):
+    return mark_safe(escape(text).replace(MARK_OPEN, '<mark>')
+                     .replace(MARK_CLOSE, '</mark>'))
+
+
+def highlights(query, post_ids):
+    """Подсветка для страницы выдачи.
+
+    Возвращает {post_id: (текст поста, фрагмент комментария)}; если
+    слова нашлись только в комментарии, текст поста None, и наоборот.
+    """
+    if not post_ids:
+        return {}
+    placeholders = ','.join(['%s'] * len(post_ids))
+    found = {pk: [None, None] for pk in post_ids}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid, highlight(posts_post_fts, 0, %s, %s) '
+            f'FROM posts_post_fts WHERE posts_post_fts MATCH %s '
+            f'AND rowid IN ({placeholders})',
+            [MARK_OPEN, MARK_CLOSE, query, *post_ids])
+        for pk, text in cursor.fetchall():
+            found[pk][0] = _mark(text)
+        cursor.execute(
+            f'SELECT comment.post_id, '
+            f"snippet(posts_comment_fts, 0, %s, %s, '…', 16) "
+            f'FROM posts_comment_fts '
+            f'JOIN posts_comment AS comment '
+            f'ON comment.id = posts_comment_fts.rowid '
+            f'WHERE posts_comment_fts MATCH %s '
+            f'AND comment.post_id IN ({placeholders}) '
+            f'ORDER BY bm25(posts_comment_fts) DESC',
+            [MARK_OPEN, MARK_CLOSE, query, *post_ids])
+        # Сортировка по убыванию: лучший фрагмент записывается последним.
+        for pk, text in cursor.fetchall():
+            found[pk][1] = _mark(text)
+    return {pk: tuple(pair) for pk, pair in found.items()}
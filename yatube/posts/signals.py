@@ -0,0 +1,95 @@
+from django.db import connections
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .caching import ALL_FEEDS, bump_feeds, post_scopes
+from .counters import bump_post_comments, bump_user
+from .feeds import fan_out_post, follow_scopes
+from .follows import followed, unfollowed
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .search import install
+from .thumbnails import prepare
+
+
+def install_search_index(sender, using, **kwargs):
+    # Пересоздание таблицы в миграциях SQLite теряет триггеры индекса.
+    install(connections[using])
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        bump_user(instance.author_id, 'posts_count', 1)
+        fan_out_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def prepare_thumbnails(sender, instance, raw=False, **kwargs):
+    if not raw:
+        prepare(instance)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    bump_user(instance.author_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        bump_post_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    bump_post_comments(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        followed(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    unfollowed(instance.user_id, instance.author_id)
+
+
+@receiver(post_init, sender=Post)
+def remember_group(sender, instance, **kwargs):
+    # При смене группы сбрасывать надо и старую ленту группы.
+    instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_feeds(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_feeds(*post_scopes(instance, [instance._loaded_group_id]),
+                   *follow_scopes(instance.author_id))
+        instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_feeds(sender, raw=False, **kwargs):
+    if not raw:
+        bump_feeds(ALL_FEEDS)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_feeds(sender, created, update_fields=None,
+                            raw=False, **kwargs):
+    # У нового пользователя нет постов, а вход сохраняет только
+    # last_login: ленты от этого не меняются.
+    if raw or created or (
+            update_fields and set(update_fields) <= {'last_login'}):
+        return
+    bump_feeds(ALL_FEEDS)
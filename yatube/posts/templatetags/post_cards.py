@@ -0,0 +1,56 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts.thumbnails import prefetch
+
+register = template.Library()
+
+CARD_TEMPLATE = 'posts/includes/card_post.html'
+
+
+def card_version(post):
+    """Отпечаток всего, что попадает в карточку поста.
+
+    Правку самого поста отмечает updated_at, а имя автора и слаг группы
+    живут в других таблицах и входят в отпечаток отдельно. Любая правка
+    даёт новый ключ, поэтому сбрасывать ничего не нужно: старые карточки
+    доживают TTL.
+    """
+    parts = (post.updated_at.isoformat(),
+             post.author.username, post.author.get_full_name(),
+             post.group.slug if post.group_id else '')
+    return hashlib.md5('\x00'.join(parts).encode()).hexdigest()
+
+
+def card_key(post, flags):
+    return f'card:{post.pk}:{card_version(post)}:{flags}'
+
+
+@register.simple_tag
+def post_cards(posts, profile_link_flag=False, group_link_flag=False):
+    """Карточки постов страницы: одним get_many из кэша, промахи
+    рендерятся (миниатюры для них читаются пачкой) и пишутся обратно
+    одним set_many."""
+    flags = f'p{int(bool(profile_link_flag))}g{int(bool(group_link_flag))}'
+    keys = [card_key(post, flags) for post in posts]
+    cards = cache.get_many(keys)
+    # Миниатюры нужны только карточкам, которых нет в кэше.
+    stale = {key: post for key, post in zip(keys, posts)
+             if key not in cards}
+    prefetch(stale.values(), 'card')
+    missing = {}
+    for key, post in stale.items():
+        missing[key] = render_to_string(CARD_TEMPLATE, {
+            'post': post,
+            'profile_link_flag': profile_link_flag,
+            'group_link_flag': group_link_flag,
+        })
+    if missing:
+        cache.set_many(missing, settings.CARD_CACHE_TIMEOUT)
+        cards.update(missing)
+    return [mark_safe(cards[key]) for key in keys]
@@ -0,0 +1,14 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/picture.html')
+def post_picture(post, size):
+    """<picture> с вариантами миниатюры размера size из POST_THUMBNAILS
+    или, пока их нет, оригинал: рендер страницы не ждёт Pillow."""
+    if not post.image:
+        return {}
+    return thumbnails.picture(post, size)
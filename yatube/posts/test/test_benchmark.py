@@ -0,0 +1,53 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from posts.models import Post
+
+
+class BenchmarkViewsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.output = os.path.join(directory, 'result.json')
+        self.baseline = os.path.join(directory, 'baseline.json')
+
+    def run_benchmark(self, **options):
+        call_command('benchmark_views', sizes='small', repeat=3,
+                     output=self.output, stdout=StringIO(), **options)
+        with open(self.output) as result:
+            return json.load(result)
+
+    def test_report_and_regressions(self):
+        """Отчёт содержит все страницы, а лишний запрос — регрессия."""
+        report = self.run_benchmark()
+        views = report['results']['small']
+        self.assertEqual(set(views), {
+            'index', 'group_posts', 'profile', 'post_detail',
+            'follow_index', 'post_create', 'add_comment'})
+        self.assertLessEqual(views['index']['p50_ms'],
+                             views['index']['p99_ms'])
+        self.assertGreater(views['index']['bytes'], 0)
+        views['index']['queries'] -= 1
+        with open(self.baseline, 'w') as baseline:
+            json.dump(report, baseline)
+        with self.assertRaisesMessage(CommandError, 'small/index'):
+            self.run_benchmark(baseline=self.baseline, threshold=100)
+
+
+class AdviseIndexesTests(TestCase):
+    def test_runs_over_all_urls(self):
+        """Команда обходит все URL, а данные откатываются."""
+        output = StringIO()
+        call_command('advise_indexes', users=20, posts=200, comments=2,
+                     repeat=1, stdout=output)
+        self.assertIn('resized_image: пропущен', output.getvalue())
+        self.assertFalse(
+            Post.objects.filter(author__username__startswith='advise_')
+            .exists())
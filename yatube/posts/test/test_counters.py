@@ -0,0 +1,93 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Post, TimelineEntry, UserStats
+
+User = get_user_model()
+
+
+class CountersTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_post_and_comment_counters(self):
+        """Счётчики постов и комментариев следуют за созданием и удалением."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Post.objects.create(author=self.author, text='Ещё пост')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        post.refresh_from_db()
+        self.assertEqual(self.stats(self.author).posts_count, 2)
+        self.assertEqual(post.comments_count, 2)
+        Comment.objects.filter(post=post).first().delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        Post.objects.filter(author=self.author).delete()
+        self.assertEqual(self.stats(self.author).posts_count, 0)
+
+    def test_comment_rolls_back_with_counter(self):
+        """Сбой счётчика откатывает и сам комментарий."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        client = Client()
+        client.force_login(self.reader)
+        url = reverse('posts:add_comment', kwargs={'post_id': post.pk})
+        with mock.patch('posts.signals.bump_post_comments',
+                        side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                client.post(url, {'text': 'Ок'})
+        self.assertFalse(Comment.objects.exists())
+
+    def test_follow_counters(self):
+        """Счётчики подписок учитывают каскадное удаление."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+        self.reader.delete()
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+
+    def test_rebuild_counters(self):
+        """Команда находит и чинит разошедшиеся счётчики."""
+        Post.objects.bulk_create([Post(author=self.author, text='Без')])
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', '--check', stdout=StringIO())
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        call_command('rebuild_counters', '--check', stdout=StringIO())
+
+
+class SeedTests(TestCase):
+    def test_seed_is_consistent_and_deterministic(self):
+        """Сгенерированные данные согласованы, а --seed их повторяет."""
+        options = {'users': 30, 'posts': 300, 'comments': 100,
+                   'groups': 3, 'follows': 5, 'stdout': StringIO()}
+        call_command('seed_yatube', prefix='one', **options)
+        call_command('seed_yatube', prefix='two', **options)
+        call_command('rebuild_counters', '--check', stdout=StringIO())
+        call_command('rebuild_search_index', '--check', stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.exists())
+        texts = [
+            list(Post.objects.filter(author__username__startswith=prefix)
+                 .order_by('pk').values_list('text', 'pub_date'))
+            for prefix in ('one_', 'two_')]
+        self.assertEqual(len(texts[0]), 300)
+        self.assertEqual(texts[0], texts[1])
+
+    def test_seed_after_deleted_posts(self):
+        """Комментарии ссылаются на свои посты, даже если pk с пропуском."""
+        author = User.objects.create_user(username='gone')
+        Post.objects.create(author=author, text='Удалённый').delete()
+        call_command('seed_yatube', prefix='gap', users=5, posts=20,
+                     comments=50, groups=1, follows=1, stdout=StringIO())
+        self.assertEqual(
+            Comment.objects.filter(
+                post__author__username__startswith='gap_').count(), 50)
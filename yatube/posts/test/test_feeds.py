@@ -0,0 +1,154 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.caching import _bump, follow_scope, pulled_scope
+from posts.feeds import is_pulled
+from posts.models import Follow, Post, TimelineEntry, UserStats
+
+User = get_user_model()
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='author')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def feed(self):
+        response = self.client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'].object_list)
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Подписка добавляет старые посты в ленту, отписка убирает."""
+        old = Post.objects.create(author=self.author, text='Старый')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.feed(), [old])
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_new_post_is_fanned_out(self):
+        """Новый пост попадает в ленты подписчиков, но не чужие."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        stranger = User.objects.create_user(username='stranger')
+        post = Post.objects.create(author=self.author, text='Новый')
+        Post.objects.create(author=stranger, text='Чужой')
+        self.assertEqual(self.feed(), [post])
+        post.delete()
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(FEED_TIMELINE_LENGTH=2)
+    def test_timeline_is_bounded(self):
+        """Раскладка поста обрезает ленту до FEED_TIMELINE_LENGTH свежих
+        записей, даже если её не открывают."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        posts = [Post.objects.create(author=self.author, text=str(i))
+                 for i in range(4)]
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('post', flat=True)),
+            [posts[3].pk, posts[2].pk])
+
+    @override_settings(FEED_PULL_THRESHOLD=1)
+    def test_hybrid_feed_merges_pulled_authors(self):
+        """Посты популярного автора читаются при запросе и сливаются."""
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.reader, author=other)
+        UserStats.objects.filter(user=other).update(
+            followers_count=0, feed_pulled=False)
+        Follow.objects.create(user=self.reader, author=self.author)
+        posts = [
+            Post.objects.create(author=self.author, text='Звезда 1'),
+            Post.objects.create(author=other, text='Обычный'),
+            Post.objects.create(author=self.author, text='Звезда 2'),
+        ]
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('post', flat=True)),
+            [posts[1].pk])
+        self.assertEqual(self.feed(), posts[::-1])
+
+    @override_settings(FEED_PULL_THRESHOLD=2)
+    def test_author_crosses_threshold(self):
+        """Посты, написанные, пока автор читался при запросе, и подписки
+        того времени не теряются после его возврата в раскладку."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        first = Post.objects.create(author=self.author, text='Первый')
+        late = User.objects.create_user(username='late')
+        Follow.objects.create(user=late, author=self.author)
+        self.assertTrue(is_pulled(self.author.pk))
+        self.assertFalse(TimelineEntry.objects.exists())
+        second = Post.objects.create(author=self.author, text='Второй')
+        self.assertEqual(self.feed(), [second, first])
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertFalse(is_pulled(self.author.pk))
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('user', 'post')),
+            [(late.pk, second.pk), (late.pk, first.pk)])
+        self.client.force_login(late)
+        self.assertEqual(self.feed(), [second, first])
+
+    def edit_post(self, post):
+        """Правит пост и возвращает сдвинутые скоупы."""
+        url = reverse('posts:follow_index')
+        self.assertContains(self.client.get(url), 'Черновик')
+        with mock.patch('posts.caching._bump', wraps=_bump) as bump:
+            post.text = 'Исправлено'
+            post.save()
+        self.assertContains(self.client.get(url), 'Исправлено')
+        return set().union(*(call.args[0] for call in bump.mock_calls))
+
+    def test_post_edit_bumps_followers(self):
+        """Правка поста раскладываемого автора сдвигает ленты его
+        подписчиков, а не общую версию популярных авторов."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='Черновик')
+        scopes = self.edit_post(post)
+        self.assertIn(follow_scope(self.reader.pk), scopes)
+        self.assertNotIn(pulled_scope(), scopes)
+
+    @override_settings(FEED_PULL_THRESHOLD=2)
+    def test_pulled_post_edit_bumps_shared_scope(self):
+        """Правка поста популярного автора сдвигает одну общую версию,
+        а не ленту каждого подписчика."""
+        for i in range(3):
+            Follow.objects.create(
+                user=User.objects.create_user(username=f'fan{i}'),
+                author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='Черновик')
+        scopes = self.edit_post(post)
+        self.assertIn(pulled_scope(), scopes)
+        self.assertFalse([scope for scope in scopes
+                          if scope.startswith('follow:')])
+
+    def test_follow_feed_cache_is_per_user(self):
+        """Кэш ленты подписок не делится между пользователями и лентами."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(author=self.author, text='Для подписчика')
+        stranger_user = User.objects.create_user(username='stranger')
+        Post.objects.create(author=stranger_user, text='Для всех')
+        self.assertContains(self.client.get(reverse('posts:index')),
+                            'Для всех')
+        url = reverse('posts:follow_index')
+        response = self.client.get(url)
+        self.assertContains(response, 'Для подписчика')
+        self.assertNotContains(response, 'Для всех')
+        stranger = Client()
+        stranger.force_login(stranger_user)
+        self.assertNotContains(stranger.get(url), 'Для подписчика')
+
+    def test_follow_feed_cache_invalidation(self):
+        """Подписка, отписка и новый пост сбрасывают кэш ленты."""
+        url = reverse('posts:follow_index')
+        Post.objects.create(author=self.author, text='Старый пост')
+        self.assertNotContains(self.client.get(url), 'Старый пост')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertContains(self.client.get(url), 'Старый пост')
+        Post.objects.create(author=self.author, text='Свежий пост')
+        self.assertContains(self.client.get(url), 'Свежий пост')
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertNotContains(self.client.get(url), 'Свежий пост')
@@ -1,4 +1,5 @@
 from http import HTTPStatus
+from io import BytesIO
 
 import shutil
 import tempfile
@@ -8,9 +9,11 @@ from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
+from PIL import Image
 
 from posts.models import Group, Post, Comment
 from posts.forms import PostForm
+from posts.images import ORIENTATION
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -259,6 +262,60 @@ class PostCreateFormTests(TestCase):
                          f'posts/{form_data["image"]}')
 
 
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_MAX_SIDE=600)
+class ImageIngestTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='photographer')
+
+    def upload(self, size, orientation=1, name='photo.jpg'):
+        exif = Image.Exif()
+        exif[ORIENTATION] = orientation
+        content = BytesIO()
+        Image.new('RGB', size, 'red').save(content, 'JPEG',
+                                           exif=exif.tobytes())
+        return SimpleUploadedFile(name, content.getvalue(),
+                                  content_type='image/jpeg')
+
+    def save(self, upload):
+        form = PostForm(data={'text': 'Фото'}, files={'image': upload})
+        self.assertTrue(form.is_valid(), form.errors)
+        post = form.save(commit=False)
+        post.author = self.user
+        post.save()
+        return post
+
+    def test_rotated_and_downscaled(self):
+        """Поворот по EXIF, вписывание в IMAGE_MAX_SIDE, EXIF удалён."""
+        # Ориентация 6: снимок надо повернуть на 90°.
+        post = self.save(self.upload((1200, 300), orientation=6))
+        self.assertEqual((post.image_width, post.image_height), (150, 600))
+        self.assertEqual(post.image_bytes, post.image.size)
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.size, (150, 600))
+            self.assertNotIn(ORIENTATION, stored.getexif())
+
+    def test_small_image_kept(self):
+        """Картинка в пределах нормы и без EXIF сохраняется как есть."""
+        content = BytesIO()
+        Image.new('RGBA', (40, 20), 'blue').save(content, 'PNG')
+        upload = SimpleUploadedFile('small.png', content.getvalue(),
+                                    content_type='image/png')
+        post = self.save(upload)
+        self.assertEqual(post.image.name, 'posts/small.png')
+        self.assertEqual((post.image_width, post.image_height,
+                          post.image_bytes), (40, 20, len(content.getvalue())))
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        """Слишком большой холст отклоняется до декодирования."""
+        form = PostForm(data={'text': 'Фото'},
+                        files={'image': self.upload((100, 100))})
+        self.assertFalse(form.is_valid())
+        self.assertIn('мегапикселей', form.errors['image'][0])
+
+
 class CommentCreateFormTests(TestCase):
 
     @classmethod
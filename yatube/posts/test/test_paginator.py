@@ -0,0 +1,108 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from posts.management.commands.advise_indexes import explain, problems
+from posts.models import Post
+from posts.paginators import KeysetPaginator, decode_cursor
+
+User = get_user_model()
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='keyset')
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=cls.author) for i in range(23))
+        cls.factory = RequestFactory()
+
+    def get_page(self, **params):
+        paginator = KeysetPaginator(Post.objects.all(), 10)
+        return paginator.get_page_from_request(
+            self.factory.get('/', params))
+
+    def test_cursor_walk_covers_all_posts(self):
+        """Проход по курсорам выдаёт все посты по одному разу."""
+        seen = []
+        page = self.get_page()
+        numbers = [page.number]
+        seen.extend(page.object_list)
+        while page.next_cursor:
+            page = self.get_page(after=page.next_cursor)
+            numbers.append(page.number)
+            seen.extend(page.object_list)
+        expected = list(Post.objects.order_by('-pub_date', '-id'))
+        self.assertEqual(seen, expected)
+        self.assertEqual(numbers, [1, 2, 3])
+
+    def test_before_returns_previous_page(self):
+        """Курсор before возвращает на предыдущую страницу."""
+        first = self.get_page()
+        second = self.get_page(after=first.next_cursor)
+        back = self.get_page(before=second.previous_cursor)
+        self.assertEqual(back.number, 1)
+        self.assertEqual(list(back.object_list), list(first.object_list))
+        self.assertIsNone(back.previous_cursor)
+
+    def test_legacy_page_number(self):
+        """Старые ссылки ?page=N работают и совпадают с курсорами."""
+        first = self.get_page()
+        second = self.get_page(after=first.next_cursor)
+        legacy = self.get_page(page=2)
+        self.assertEqual(legacy.number, 2)
+        self.assertEqual(list(legacy.object_list),
+                         list(second.object_list))
+
+    def test_bad_input_falls_back_to_first_page(self):
+        """Мусор в параметрах ведёт на первую страницу."""
+        self.assertIsNone(decode_cursor('мусор'))
+        for params in ({'after': '!!!'}, {'page': 'abc'}, {'page': 100}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get_page(**params).number, 1)
+
+    def test_first_page_does_not_count(self):
+        """Первая страница — один запрос без COUNT(*)."""
+        with self.assertNumQueries(1):
+            page = self.get_page()
+        self.assertEqual(len(page.object_list), 10)
+
+    def test_elided_range_without_total(self):
+        """Без общего числа окно не уходит дальше следующей страницы."""
+        paginator = KeysetPaginator(Post.objects.all(), 2,
+                                    show_total=False)
+        page = paginator.get_page(6)
+        with self.assertNumQueries(0):
+            links = paginator.get_elided_page_range(page)
+        self.assertEqual([link.number for link in links],
+                         [1, paginator.ELLIPSIS, 4, 5, 6, 7])
+        self.assertTrue(links[-1].query.startswith('after='))
+        self.assertTrue(links[-3].query.startswith('before='))
+
+    def test_elided_range_with_total(self):
+        """С общим числом в окне есть последняя страница."""
+        paginator = KeysetPaginator(Post.objects.all(), 2, show_total=True)
+        page = paginator.get_page(1)
+        links = paginator.get_elided_page_range(page)
+        self.assertEqual([link.number for link in links],
+                         [1, 2, 3, paginator.ELLIPSIS, 12])
+        self.assertEqual(links[-1].query, 'page=last')
+        last = paginator.get_page('last')
+        self.assertEqual(last.number, 12)
+        self.assertEqual(len(last.object_list), 1)
+        self.assertIsNone(last.next_cursor)
+
+    def test_feed_pages_use_indexes(self):
+        """Страницы лент читаются по индексу, без сортировки и просмотра."""
+        feeds = (Post.objects.all(), self.author.posts.all(),
+                 Post.objects.filter(group=1))
+        for queryset in feeds:
+            paginator = KeysetPaginator(queryset, 10)
+            for values in (None, (self.author.date_joined, 5)):
+                with self.subTest(query=str(queryset.query), values=values):
+                    with CaptureQueriesContext(connection) as queries:
+                        paginator._fetch(values)
+                    plan = explain(queries.captured_queries[-1]['sql'])
+                    self.assertEqual(problems(plan), [], plan)
@@ -0,0 +1,95 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from posts import resize
+from posts.resize import resize_url
+
+
+def jpeg(size=(400, 300)):
+    content = io.BytesIO()
+    Image.new('RGB', size, 'navy').save(content, 'JPEG')
+    return content.getvalue()
+
+
+class ResizeEndpointTests(TestCase):
+    def setUp(self):
+        media, resized = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, resized, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media,
+                                     RESIZE_CACHE_DIR=resized)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.name = default_storage.save(
+            'posts/photo.jpg', SimpleUploadedFile('photo.jpg', jpeg()))
+
+    def get_image(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, Image.open(io.BytesIO(b''.join(response)))
+
+    def test_crop_and_fit(self):
+        """Картинка обрезается или вписывается и кэшируется надолго."""
+        response, image = self.get_image(resize_url(self.name, 100, 100))
+        self.assertEqual(image.size, (100, 100))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        _, image = self.get_image(resize_url(self.name, 100, 100, 'fit'))
+        self.assertEqual(image.size, (100, 75))
+
+    def test_bad_signature(self):
+        """Без верной подписи размер не заказать."""
+        url = resize_url(self.name, 100, 100).replace('100x100', '101x100')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        missing = resize_url('posts/nothing.jpg', 100, 100)
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_resized_once(self):
+        """Повторные и одновременные запросы не ресайзят заново."""
+        url = resize_url(self.name, 120, 90)
+        started = threading.Event()
+
+        def slow(*args):
+            started.set()
+            threading.Event().wait(0.2)
+            return original(*args)
+
+        original = resize.resized
+        with mock.patch('posts.resize.resized', side_effect=slow) as spy:
+            thread = threading.Thread(
+                target=lambda: resize.render(self.name, 120, 90,
+                                             'center').close())
+            thread.start()
+            started.wait()
+            self.get_image(url)
+            thread.join()
+            self.get_image(url)
+        self.assertEqual(spy.call_count, 1)
+
+    def test_evict_least_recently_read(self):
+        """Сверх лимита удаляются давно не читанные варианты."""
+        paths = []
+        for age, width in enumerate((50, 60, 70)):
+            resize.render(self.name, width, 50, 'center').close()
+            path = resize.cache_path(self.name, width, 50, 'center')
+            past = time.time() - 1000 * (3 - age)
+            os.utime(path, (past, past))
+            paths.append(path)
+        # Чтение освежает самый старый вариант.
+        resize._open(paths[0]).close()
+        limit = sum(os.path.getsize(path) for path in paths[::2])
+        resize.evict(settings.RESIZE_CACHE_DIR, limit)
+        self.assertEqual([os.path.exists(path) for path in paths],
+                         [True, False, True])
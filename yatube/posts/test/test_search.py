@@ -0,0 +1,86 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Post
+
+User = get_user_model()
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_superuser(
+            username='search', email='search@example.com', password='pass')
+        cls.in_text = Post.objects.create(
+            author=cls.user, text='Рецепт борща <b>со сметаной</b>')
+        cls.in_comment = Post.objects.create(author=cls.user,
+                                             text='Обед')
+        Comment.objects.create(post=cls.in_comment, author=cls.user,
+                               text='А борщ был с пампушками?')
+        Post.objects.create(author=cls.user, text='Совсем о другом')
+
+    def search(self, **params):
+        response = self.client.get(reverse('posts:search'), params)
+        return list(response.context.get('page_obj') or []), response
+
+    def test_finds_posts_and_comments(self):
+        """Ищутся слова поста и его комментариев, пост выше комментария."""
+        found, _ = self.search(q='борщ')
+        self.assertEqual(found, [self.in_text, self.in_comment])
+
+    def test_highlight_is_escaped(self):
+        """Подсветка в <mark>, а HTML из текста экранирован."""
+        _, response = self.search(q='сметан')
+        self.assertContains(response, '<mark>сметаной</mark>')
+        self.assertContains(response, '&lt;b&gt;')
+        _, response = self.search(q='пампушк')
+        self.assertContains(response, '<mark>пампушками</mark>')
+
+    def test_index_follows_changes(self):
+        """Правки и удаление сразу видны в поиске."""
+        Post.objects.filter(pk=self.in_text.pk).update(text='Щи')
+        self.assertEqual(self.search(q='щи')[0], [self.in_text])
+        self.assertEqual(self.search(q='борщ')[0], [self.in_comment])
+        Comment.objects.all().delete()
+        self.assertEqual(self.search(q='борщ')[0], [])
+
+    def test_operators_are_ignored(self):
+        """Синтаксис FTS5 во вводе не ломает запрос."""
+        for text in ('"борщ', 'борщ OR NEAR(', '***', ''):
+            with self.subTest(text=text):
+                _, response = self.search(q=text)
+                self.assertEqual(response.status_code, 200)
+
+    def test_keyset_pages(self):
+        """Выдача листается курсором по релевантности."""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Суп номер {i}')
+            for i in range(15))
+        first, response = self.search(q='суп')
+        cursor = response.context['page_obj'].next_cursor
+        second, _ = self.search(q='суп', after=cursor)
+        self.assertEqual(len(first), 10)
+        self.assertEqual(len(second), 5)
+        self.assertFalse(set(first) & set(second))
+
+    def test_admin_uses_index(self):
+        """Поиск в админке идёт через индекс FTS5."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('admin:posts_post_changelist'),
+                                   {'q': 'борщ'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.in_text])
+
+    def test_rebuild_command(self):
+        """Команда перестраивает индекс и сверяет его с таблицами."""
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        call_command('rebuild_search_index', '--check', stdout=out)
+        self.assertIn('в порядке', out.getvalue())
+        self.assertEqual(self.search(q='борщ')[0],
+                         [self.in_text, self.in_comment])
@@ -0,0 +1,132 @@
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import thumbnails
+from posts.models import Post
+from posts.resize import resize_url
+
+User = get_user_model()
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+TAG = Template('{% load post_thumbnails %}{% post_picture post "card" %}')
+
+
+def main_thumbnail(post):
+    """Миниатюра запасного формата во всю ширину — src у <img>."""
+    found = thumbnails.lookup(post.image, 'card')
+    return found[max(found, key=lambda variant: (
+        variant.format == 'JPEG', variant.width))]
+
+
+class MediaMixin:
+    def setUp(self):
+        super().setUp()
+        # Хранилище sorl кэширует записи: файлы прошлых тестов не видны.
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='photographer')
+
+    def upload(self):
+        return SimpleUploadedFile('small.gif', SMALL_GIF,
+                                  content_type='image/gif')
+
+
+class InlineThumbnailTests(MediaMixin, TestCase):
+    def test_created_on_save(self):
+        """Без пула миниатюры готовятся при сохранении поста."""
+        post = Post.objects.create(author=self.user, text='Фото',
+                                   image=self.upload())
+        self.assertTrue(all(thumbnails.lookup(post.image, 'card').values()))
+        html = TAG.render(Context({'post': post}))
+        self.assertIn(f'src="{main_thumbnail(post).url}"', html)
+        self.assertIn(' 480w, ', html)
+        self.assertIn('width="960" height="339"', html)
+        self.assertIn('loading="lazy"', html)
+
+    @override_settings(POST_THUMBNAIL_FORMATS=('NOPE', 'PNG', 'JPEG'))
+    def test_modern_formats_as_sources(self):
+        """Форматы сверх запасного идут в <source>, неизвестные Pillow
+        пропускаются."""
+        self.assertEqual({variant.format
+                          for variant in thumbnails.variants('card')},
+                         {'PNG', 'JPEG'})
+        post = Post.objects.create(author=self.user, text='Фото',
+                                   image=self.upload())
+        html = TAG.render(Context({'post': post}))
+        self.assertEqual(html.count('<source'), 1)
+        self.assertIn('<source type="image/png"', html)
+        self.assertIn('.png 960w', html)
+        with override_settings(POST_THUMBNAIL_FORMATS=('NOPE',)):
+            self.assertEqual(thumbnails.supported_formats(), ['JPEG'])
+
+    def test_feed_page_reads_store_once(self):
+        """Миниатюры всех карточек страницы читаются одним запросом."""
+        posts = [Post.objects.create(author=self.user, text=f'Фото {i}',
+                                     image=self.upload())
+                 for i in range(7)]
+        Post.objects.create(author=self.user, text='Без картинки')
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        store = [query for query in queries.captured_queries
+                 if 'thumbnail_kvstore' in query['sql']]
+        self.assertEqual(len(store), 1)
+        for post in posts:
+            self.assertContains(response, main_thumbnail(post).url)
+
+    def test_lookup_many_missing(self):
+        """Отсутствие миниатюры запоминается в кэше sorl."""
+        found = thumbnails.lookup_many(['posts/nothing.gif'], 'card')
+        self.assertEqual(list(found), ['posts/nothing.gif'])
+        self.assertFalse(any(found['posts/nothing.gif'].values()))
+        # Отсутствие запомнено в кэше: повторно в базу не идём.
+        with self.assertNumQueries(0):
+            thumbnails.lookup_many(['posts/nothing.gif'], 'card')
+
+
+@override_settings(THUMBNAIL_WORKERS=1)
+class PooledThumbnailTests(MediaMixin, TransactionTestCase):
+    def test_pool_creates_and_touches_post(self):
+        """Пул создаёт миниатюры после коммита и трогает пост."""
+        post = Post.objects.create(author=self.user, text='Фото',
+                                   image=self.upload())
+        thumbnails.drain()
+        self.assertTrue(all(thumbnails.lookup(post.image, 'card').values()))
+        self.assertGreater(Post.objects.get(pk=post.pk).updated_at,
+                           post.updated_at)
+
+    def test_template_does_not_wait(self):
+        """Пока миниатюры нет, тег отдаёт URL ресайза по запросу и ставит
+        её в очередь."""
+        post = Post.objects.create(author=self.user, text='Без картинки')
+        image = self.upload()
+        # Картинка без сигналов, как у постов из старых данных.
+        post.image.save(image.name, image, save=False)
+        Post.objects.filter(pk=post.pk).update(image=post.image.name)
+        html = TAG.render(Context({'post': post}))
+        self.assertIn(f'src="{resize_url(post.image.name, 960, 339)}"',
+                      html)
+        self.assertNotIn('srcset', html)
+        thumbnails.drain()
+        self.assertIn(f'src="{main_thumbnail(post).url}"',
+                      TAG.render(Context({'post': post})))
@@ -2,6 +2,7 @@ from http import HTTPStatus
 
 import shutil
 import tempfile
+from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.test import TestCase, Client, override_settings
@@ -10,8 +11,13 @@ from django import forms
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 
-from posts.models import Post, Group, Comment, Follow
+from core.nplusone import query_budget
+from posts.models import (Comment, Follow, Group, Post, TimelineEntry,
+                          UserStats)
+from posts.templatetags.post_cards import post_cards
 
 
 User = get_user_model()
@@ -159,6 +165,16 @@ class ViewsURLTests(TestCase):
         self.assertEqual(first_object.group.title, self.group.title)
         self.assertEqual(first_object.image, self.post.image)
 
+    def test_post_detail_query_budget(self):
+        """Число запросов post_detail не растёт с числом комментариев."""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        for i in range(10):
+            Comment.objects.create(
+                post=self.post, text=f'Комментарий {i}',
+                author=User.objects.create_user(username=f'commenter{i}'))
+        with query_budget(7):
+            self.authorized_client.get(url)
+
     def test_comment(self):
         """Проверка коментария."""
         comment_count = Comment.objects.count()
@@ -304,15 +320,137 @@ class CacheTests(TestCase):
     def test_cache_index(self):
         """Тест кэш страницы index"""
         response = self.authorized_client.get(reverse('posts:index'))
-        post_1 = Post.objects.get(pk=1)
-        post_1.text = 'Измененный текст'
-        post_1.save()
+        # Правка в обход сигналов в кэш не попадает.
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
         response2 = self.authorized_client.get(reverse('posts:index'))
         self.assertEqual(response.content, response2.content)
         cache.clear()
         response3 = self.authorized_client.get(reverse('posts:index'))
         self.assertNotEqual(response.content, response3.content)
 
+    def test_cache_invalidated_on_post_change(self):
+        """Правка и создание поста сразу видны в лентах."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile',
+                    kwargs={'username': self.post.author}),
+        )
+        for url in urls:
+            self.authorized_client.get(url)
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Измененный текст'
+        post.save()
+        Post.objects.create(author=self.post.author, text='Новая запись')
+        for url in urls:
+            with self.subTest(url=url):
+                content = self.authorized_client.get(url).content.decode()
+                self.assertIn('Измененный текст', content)
+                self.assertIn('Новая запись', content)
+
+
+class CardCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='cards')
+        for i in range(3):
+            Post.objects.create(author=cls.user, text=f'Карточка {i}')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cards_fetched_with_one_get_many(self):
+        """Второй рендер страницы берёт все карточки из кэша."""
+        posts = list(Post.objects.select_related('author', 'group'))
+        first = post_cards(posts)
+        with mock.patch('posts.templatetags.post_cards.render_to_string',
+                        side_effect=AssertionError) as render:
+            self.assertEqual(post_cards(posts), first)
+        render.assert_not_called()
+
+    def test_edit_invalidates_only_its_card(self):
+        """Правка поста перерисовывает только его карточку."""
+        posts = list(Post.objects.select_related('author', 'group'))
+        post_cards(posts)
+        posts[0].text = 'Новый текст'
+        posts[0].save()
+        with mock.patch('posts.templatetags.post_cards.render_to_string',
+                        return_value='card') as render:
+            cards = post_cards(posts)
+        render.assert_called_once()
+        self.assertEqual(cards[0], 'card')
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='etag')
+        cls.group = Group.objects.create(title='Группа', slug='etag',
+                                         description='Описание')
+        cls.post = Post.objects.create(author=cls.user, text='Пост',
+                                       group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+
+    def test_not_modified_skips_page_queries(self):
+        """Совпавший ETag отдаёт 304, не выбирая посты."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+                self.assertFalse(any(
+                    'FROM "posts_post"' in query['sql']
+                    and 'updated_at' not in query['sql']
+                    for query in queries.captured_queries))
+
+    def test_etag_changes_on_new_post(self):
+        """Новый пост меняет ETag лент и страницы поста."""
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Новый текст'
+        post.save()
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_post_etag_changes_on_group_rename(self):
+        """Переименование группы меняет ETag страницы поста."""
+        url = self.urls[-1]
+        etag = self.client.get(url)['ETag']
+        self.group.title = 'Новое имя'
+        self.group.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_post_etag_changes_on_login(self):
+        """После повторного входа страница с формой приходит заново."""
+        url = self.urls[-1]
+        self.client.force_login(self.user)
+        etag = self.client.get(url)['ETag']
+        self.client.logout()
+        self.client.force_login(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_last_modified(self):
+        """If-Modified-Since с датой после правки отдаёт 304."""
+        url = self.urls[-1]
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
 
 class FollowTests(TestCase):
     def setUp(self):
@@ -353,3 +491,51 @@ class FollowTests(TestCase):
             reverse('posts:follow_index')
         )
         self.assertEqual(response.status_code, HTTPStatus.FOUND)
+
+    def test_follow_post_is_idempotent(self):
+        """Повторный POST не дублирует подписку и счётчики."""
+        url = reverse('posts:profile_follow',
+                      kwargs={'username': self.user_following.username})
+        for changed in (True, False):
+            with self.subTest(changed=changed):
+                response = self.client_auth_follower.post(
+                    url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+                self.assertEqual(response.json(),
+                                 {'following': True, 'changed': changed})
+        self.assertEqual(Follow.objects.count(), 1)
+        stats = UserStats.objects.get(user=self.user_following)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.user_follower).count(), 1)
+
+    def test_unfollow_post_json(self):
+        """Отписка через AJAX возвращает статус и снимает счётчики."""
+        Follow.objects.create(user=self.user_follower,
+                              author=self.user_following)
+        url = reverse('posts:profile_unfollow',
+                      kwargs={'username': self.user_following.username})
+        response = self.client_auth_follower.post(
+            url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(),
+                         {'following': False, 'changed': True})
+        stats = UserStats.objects.get(user=self.user_following)
+        self.assertEqual(stats.followers_count, 0)
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_follow_unknown_and_self(self):
+        """Неизвестный автор — 404, на себя подписаться нельзя."""
+        response = self.client_auth_follower.post(reverse(
+            'posts:profile_follow', kwargs={'username': 'nobody'}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.client_auth_follower.post(reverse(
+            'posts:profile_follow',
+            kwargs={'username': self.user_follower.username}))
+        self.assertFalse(Follow.objects.exists())
+
+    def test_unique_constraint(self):
+        """База не даёт создать вторую такую же подписку."""
+        Follow.objects.create(user=self.user_follower,
+                              author=self.user_following)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user_follower,
+                                  author=self.user_following)
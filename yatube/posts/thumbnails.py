@@ -0,0 +1,287 @@
+"""Миниатюры картинок постов без ожидания в запросе.
+
+{% thumbnail %} из sorl создаёт миниатюру при первом рендере, и первый
+просмотр ленты после поста с большой фотографией ждёт декодирования и
+ресайза в Pillow. Здесь миниатюры всех размеров POST_THUMBNAILS — каждая
+в нескольких ширинах (POST_THUMBNAIL_SCALES) и форматах
+(POST_THUMBNAIL_FORMATS, из тех, что умеет Pillow) — готовятся пулом
+потоков (THUMBNAIL_WORKERS) сразу после сохранения поста. Тег
+{% post_picture %} рисует из них <picture> с srcset, только заглядывая
+в хранилище sorl, а пока миниатюры нет, отдаёт URL ресайза по запросу
+(posts.resize) или оригинал. Когда пул её создал, пост «трогается»:
+новый updated_at и сброс версий лент меняют ключи карточек, фрагментов
+и ETag, так что страницы без миниатюры не задерживаются в кэше. При
+THUMBNAIL_WORKERS = 0 всё делается в самом запросе.
+
+Карточкам ленты миниатюры достаются заранее, через prefetch: одним
+get_many из кэша sorl и одним запросом к его таблице на страницу
+вместо обращения на каждую картинку.
+"""
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image
+from sorl.thumbnail import base, default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import serialize, tokey
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from core.nplusone import ignored
+
+from .caching import bump_feeds, post_scopes
+from .feeds import follow_scopes
+from .models import Post
+from .resize import resize_url
+
+logger = logging.getLogger(__name__)
+
+# options — пары (имя, значение): вариант служит ключом словаря.
+Variant = namedtuple('Variant', 'format width geometry options')
+MIME_TYPES = {'AVIF': 'image/avif', 'WEBP': 'image/webp',
+              'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+
+_executor = None
+_pending = set()
+_failed = set()
+_lock = threading.Lock()
+
+
+class ThumbnailBackend(base.ThumbnailBackend):
+    """Бэкенд sorl, который умеет искать миниатюру, не создавая её."""
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        # Те же умолчания, что в get_thumbnail, иначе имя не совпадёт.
+        source = ImageFile(file_)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string,
+                                            options)
+        return ImageFile(name, default.storage)
+
+    def _get_thumbnail_filename(self, source, geometry_string, options):
+        # Как у sorl, но с расширением и для форматов, которых он не знает
+        # (AVIF).
+        key = tokey(source.key, geometry_string, serialize(options))
+        format_ = options['format']
+        extension = base.EXTENSIONS.get(format_, format_.lower())
+        return (f'{sorl_settings.THUMBNAIL_PREFIX}'
+                f'{key[:2]}/{key[2:4]}/{key}.{extension}')
+
+
+def supported_formats():
+    """Форматы из POST_THUMBNAIL_FORMATS, которые умеет записать Pillow,
+    или JPEG, если ни одного."""
+    Image.init()
+    return [format_ for format_ in settings.POST_THUMBNAIL_FORMATS
+            if format_ in Image.SAVE] or ['JPEG']
+
+
+def variants(size):
+    """Варианты миниатюры size: каждая доля ширины в каждом формате.
+
+    Последний формат — запасной для <img>, остальные идут в <source>.
+    """
+    geometry, options = settings.POST_THUMBNAILS[size]
+    width, height = map(int, geometry.split('x'))
+    found = []
+    for format_ in supported_formats():
+        for scale in settings.POST_THUMBNAIL_SCALES:
+            scaled = round(width * scale), round(height * scale)
+            found.append(Variant(format_, scaled[0],
+                                 '{}x{}'.format(*scaled),
+                                 tuple({**options,
+                                        'format': format_}.items())))
+    return found
+
+
+def lookup_many(names, size):
+    """{имя картинки: {вариант: миниатюра или None}} для многих картинок.
+
+    То же, что cached_db_kvstore.KVStore.get по одной, но промахи кэша
+    читаются из таблицы sorl одним запросом и пишутся обратно пачкой.
+    """
+    backend, kvstore = default.backend, default.kvstore
+    files = {
+        (name, variant): backend.thumbnail_file(
+            name, variant.geometry, **dict(variant.options))
+        for name in set(names) for variant in variants(size)}
+    found = {name: {} for name in names}
+    if not isinstance(kvstore._wrapped, cached_db_kvstore.KVStore):
+        for (name, variant), file in files.items():
+            found[name][variant] = kvstore.get(file)
+        return found
+    keys = {add_prefix(file.key): pair for pair, file in files.items()}
+    values = kvstore.cache.get_many(list(keys))
+    missing = [key for key in keys if key not in values]
+    if missing:
+        stored = dict(KVStore.objects.filter(key__in=missing)
+                      .values_list('key', 'value'))
+        # Отсутствие тоже кэшируется, как это делает sorl.
+        fetched = {key: stored.get(key, cached_db_kvstore.EMPTY_VALUE)
+                   for key in missing}
+        kvstore.cache.set_many(fetched,
+                               sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(fetched)
+    for key, (name, variant) in keys.items():
+        value = values[key]
+        found[name][variant] = (
+            None if value == cached_db_kvstore.EMPTY_VALUE
+            else deserialize_image_file(value))
+    return found
+
+
+def lookup(image, size):
+    name = getattr(image, 'name', image)
+    return lookup_many([name], size)[name]
+
+
+def prefetch(posts, size):
+    """Кладёт варианты миниатюр постов в post.thumbnails[size]."""
+    posts = [post for post in posts if post.image]
+    if not posts:
+        return
+    found = lookup_many([post.image.name for post in posts], size)
+    for post in posts:
+        post.__dict__.setdefault('thumbnails', {})[size] = \
+            found[post.image.name]
+
+
+def _srcset(found, format_):
+    return ', '.join(f'{file.url} {variant.width}w'
+                     for variant, file in found.items()
+                     if variant.format == format_ and file)
+
+
+def picture(post, size):
+    """Контекст для <picture>: варианты, что готовы, или оригинал.
+
+    Пока нет основной миниатюры (запасной формат во всю ширину),
+    варианты ставятся в очередь пулу, а отдаётся URL ресайза по запросу
+    для обрезаемых размеров или оригинал с размерами из поста.
+    """
+    found = post.__dict__.get('thumbnails', {}).get(size)
+    if found is None:
+        found = lookup(post.image, size)
+    if not all(found.values()) and post.image.name not in _failed:
+        if not settings.THUMBNAIL_WORKERS:
+            _generate_safely(post.image.name)
+            found = lookup(post.image, size)
+        else:
+            enqueue(post.image.name)
+    fallback = max((variant for variant in found
+                    if variant.format == supported_formats()[-1]),
+                   key=lambda variant: variant.width)
+    main = found[fallback]
+    if not main and dict(fallback.options).get('crop'):
+        width, height = map(int, fallback.geometry.split('x'))
+        return {'src': resize_url(post.image.name, width, height),
+                'width': width, 'height': height}
+    if not main:
+        return {'src': post.image.url, 'width': post.image_width,
+                'height': post.image_height}
+    return {
+        'sources': [
+            {'type': MIME_TYPES[format_], 'srcset': _srcset(found, format_)}
+            for format_ in supported_formats()[:-1]
+            if _srcset(found, format_)],
+        'src': main.url,
+        'srcset': _srcset(found, fallback.format),
+        'sizes': f'(max-width: {fallback.width}px) 100vw, '
+                 f'{fallback.width}px',
+        'width': main.width,
+        'height': main.height,
+    }
+
+
+def generate(name):
+    """Создаёт недостающие варианты; True, если что-то создано."""
+    created = False
+    for size in settings.POST_THUMBNAILS:
+        for variant, file in lookup(name, size).items():
+            if file:
+                continue
+            # sorl ведёт учёт созданных файлов отдельными запросами.
+            with ignored():
+                get_thumbnail(name, variant.geometry,
+                              **dict(variant.options))
+            created = True
+    return created
+
+
+def touch(name):
+    """Сбрасывает кэш страниц, где вместо миниатюры стоял оригинал."""
+    for post in Post.objects.filter(image=name):
+        Post.objects.filter(pk=post.pk).update(updated_at=timezone.now())
+        bump_feeds(*post_scopes(post), *follow_scopes(post.author_id))
+
+
+def _generate_safely(name):
+    try:
+        return generate(name)
+    except Exception:
+        # Битую картинку не пытаемся обрабатывать при каждом рендере.
+        logger.exception('Не удалось создать миниатюры %s', name)
+        with _lock:
+            _failed.add(name)
+        return False
+
+
+def _work(name):
+    try:
+        if _generate_safely(name):
+            touch(name)
+    finally:
+        with _lock:
+            _pending.discard(name)
+        # У потока пула свои соединения с базой.
+        connections.close_all()
+
+
+def enqueue(name):
+    """Ставит миниатюры картинки в очередь пула, без повторов."""
+    global _executor
+    with _lock:
+        if name in _pending or name in _failed:
+            return
+        _pending.add(name)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.THUMBNAIL_WORKERS,
+                                           thread_name_prefix='thumbnails')
+        return _executor.submit(_work, name)
+
+
+def drain():
+    """Дожидается, пока пул доделает очередь."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def prepare(post):
+    """Готовит миниатюры картинки только что сохранённого поста."""
+    if not post.image:
+        return
+    name = post.image.name
+    if not settings.THUMBNAIL_WORKERS:
+        _generate_safely(name)
+        return
+    # Пул трогает пост после создания миниатюр: строка уже должна быть
+    # видна другим соединениям.
+    transaction.on_commit(lambda: enqueue(name))
@@ -1,47 +1,77 @@
-from django.urls import reverse
+from urllib.parse import urlencode
+
 from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import (condition, require_http_methods,
+                                          require_safe)
 
 from .models import Follow, Post, Group, User, Comment
 from .forms import PostForm, CommentForm
+from .conditional import (group_condition, index_condition,
+                          post_condition, profile_condition)
+from .caching import (feed_version, follow_scope, group_scope, index_scope,
+                      profile_scope, pulled_scope)
+from .feeds import feed_sources, pulled_authors
+from .follows import follow, unfollow
+from .paginators import (KeysetPaginator, MergedKeysetPaginator,
+                         SearchPaginator)
+from . import resize
+from .search import match_query
+
+
+def func_paginator(queryset, request, paginator_class=KeysetPaginator):
+    paginator = paginator_class(queryset, settings.GLOBAL_FOR_PAGINATOR)
+    page_obj = paginator.get_page_from_request(request)
+    return {
+        'page_obj': page_obj,
+        'page_links': paginator.get_elided_page_range(page_obj),
+    }
 
 
-def func_paginator(queryset, request):
-    paginator = Paginator(queryset, settings.GLOBAL_FOR_PAGINATOR)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+def feed_cache(*scopes):
+    """Параметры {% cache %} для фрагмента ленты."""
     return {
-        'page_obj': page_obj,
+        'feed_version': feed_version(*scopes),
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
     }
 
 
+@condition(**index_condition)
 def index(request):
     context = func_paginator(Post.objects.select_related
                              ('author', 'group').all(),
                              request)
+    context.update(feed_cache(index_scope()))
     return render(request, 'posts/index.html', context)
 
 
+@condition(**group_condition)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     context = {
         'group': group,
+        **feed_cache(group_scope(group.pk)),
     }
     context.update(func_paginator
                    (group.posts.select_related('author'), request))
     return render(request, 'posts/group_list.html', context)
 
 
+@condition(**profile_condition)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
     following = (request.user.is_authenticated
                  and Follow.objects.filter(user=request.user, author=author)
                  .exists())
     context = {
         'author': author,
-        'following': following
+        'following': following,
+        **feed_cache(profile_scope(author.pk)),
     }
     context.update(func_paginator
                    (author.posts.select_related('author', 'group').all(),
@@ -49,10 +79,12 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@condition(**post_condition)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id)
     form = CommentForm()
-    comment = Comment.objects.filter(post=post_id)
+    comment = Comment.objects.filter(post=post_id).select_related('author')
     context = {
         'post': post,
         'form': form,
@@ -61,6 +93,20 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def search(request):
+    text = request.GET.get('q', '').strip()
+    query = match_query(text)
+    context = {
+        'search_text': text,
+        # Ссылки пагинатора должны сохранять строку поиска.
+        'page_params': urlencode({'q': text}) + '&',
+    }
+    if query:
+        context.update(func_paginator(query, request,
+                                      paginator_class=SearchPaginator))
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -69,7 +115,9 @@ def post_create(request):
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        # Пост, счётчик автора и раскладка по лентам — вместе или никак.
+        with transaction.atomic():
+            post.save()
         return redirect('posts:profile', post.author)
     return render(request, 'posts/create_post.html', context={'form': form})
 
@@ -83,7 +131,8 @@ def post_edit(request, post_id):
             files=request.FILES or None,
             instance=post)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
             return redirect('posts:post_detail', post_id)
 
         return render(request, 'posts/create_post.html',
@@ -101,29 +150,62 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with transaction.atomic():
+            comment.save()
     return redirect('posts:post_detail', post_id)
 
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    context = func_paginator(posts, request)
+    pulled = pulled_authors(request.user)
+    context = func_paginator(feed_sources(request.user, pulled), request,
+                             paginator_class=MergedKeysetPaginator)
+    scopes = [follow_scope(request.user.pk)]
+    if pulled:
+        scopes.append(pulled_scope())
+    context.update(feed_cache(*scopes))
     return render(request, 'posts/follow.html', context)
 
 
+def follow_response(request, username, following, changed):
+    """AJAX-клиенту — статус в JSON, браузеру — редирект на профиль."""
+    if request.is_ajax() or 'application/json' in request.META.get(
+            'HTTP_ACCEPT', ''):
+        return JsonResponse({'following': following, 'changed': changed})
+    return redirect('posts:profile', username=username)
+
+
 @login_required
+@require_http_methods(['GET', 'POST'])
 def profile_follow(request, username):
-    user = request.user
-    author = User.objects.get(username=username)
-    is_follower = Follow.objects.filter(user=user, author=author)
-    if user != author and not is_follower.exists():
-        Follow.objects.get_or_create(user=user, author=author)
-    return redirect(reverse('posts:profile', args=[username]))
+    author_id = get_object_or_404(
+        User.objects.values_list('pk', flat=True), username=username)
+    changed = follow(request.user.pk, author_id)
+    return follow_response(request, username,
+                           author_id != request.user.pk, changed)
 
 
 @login_required
+@require_http_methods(['GET', 'POST'])
 def profile_unfollow(request, username):
-    author = get_object_or_404(User, username=username)
-    Follow.objects.filter(user=request.user, author=author).delete()
-    return redirect('posts:profile', username=author)
+    author_id = get_object_or_404(
+        User.objects.values_list('pk', flat=True), username=username)
+    changed = unfollow(request.user.pk, author_id)
+    return follow_response(request, username, False, changed)
+
+
+@require_safe
+@cache_control(public=True, max_age=settings.RESIZE_MAX_AGE, immutable=True)
+def resized_image(request, signature, width, height, crop, name):
+    """Картинка поста, уменьшенная по подписанному URL."""
+    max_side = settings.IMAGE_MAX_SIDE
+    if crop not in resize.CROPS or not 0 < width <= max_side \
+            or not 0 < height <= max_side \
+            or not resize.is_signed(signature, name, width, height, crop):
+        raise Http404
+    try:
+        file = resize.render(name, width, height, crop)
+    except (OSError, ValueError):
+        # Нет оригинала или Pillow не смог его прочитать.
+        raise Http404
+    return FileResponse(file, content_type=resize.content_type(file))
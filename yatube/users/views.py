@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.views.generic import CreateView
 from django.urls import reverse_lazy
 
@@ -8,3 +9,8 @@ class SignUp(CreateView):
     form_class = CreationForm
     success_url = reverse_lazy('posts:index')
     template_name = 'users/signup.html'
+
+    def form_valid(self, form):
+        # Пользователь и его UserStats из сигнала — вместе или никак.
+        with transaction.atomic():
+            return super().form_valid(form)
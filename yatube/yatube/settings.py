@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -39,6 +43,19 @@ LOGIN_REDIRECT_URL = 'posts:index'
 # LOGOUT_REDIRECT_URL = 'posts:index'
 # Application definition
 GLOBAL_FOR_PAGINATOR = 10
+# Глубже этой страницы ссылки ?page=N не ходят: дальше только курсоры
+PAGINATOR_MAX_OFFSET_PAGE = 50
+# Показывать ли последнюю страницу: это стоит COUNT(*) на каждый запрос
+PAGINATOR_SHOW_TOTAL = False
+# Сколько последних постов хранится в ленте подписок пользователя
+FEED_TIMELINE_LENGTH = 1000
+# Посты авторов с таким числом подписчиков не раскладываются по лентам,
+# а подтягиваются при чтении; None — раскладывать всё
+FEED_PULL_THRESHOLD = 10000
+# Обратно в раскладку автор возвращается, когда подписчиков стало меньше
+# FEED_PULL_THRESHOLD * FEED_PULL_HYSTERESIS: иначе автор на границе
+# гонял бы ленты подписчиков туда-обратно
+FEED_PULL_HYSTERESIS = 0.9
 GLOBAL_NUMBER_POSTS = 13
 GLOBAL_NUMBERS_LAST_POST = 15
 
@@ -54,12 +71,82 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Кэш
+# Фрагменты лент сбрасываются сигналами (posts.caching), так что TTL
+# ограничивает только память
+FEED_CACHE_TIMEOUT = 60 * 60 * 4
+# Карточки постов кэшируются по отпечатку содержимого (posts.templatetags)
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Защита от лавины пересчётов (core.cache.stampede): сколько держать
+# устаревшее значение, сколько ждать пересчёта и насколько рано обновлять
+CACHE_STALE_GRACE = 60 * 5
+CACHE_LOCK_TIMEOUT = 10
+CACHE_EARLY_REFRESH_BETA = 1.0
+# Горячие ключи держит LRU процесса (core.cache.tiered), остальное — один
+# файл на хост, который видят все воркеры (core.cache.sqlite)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.tiered.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'MAX_ENTRIES': 2000,
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.sqlite.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_BYTES': 256 * 1024 * 1024,
+        },
+    },
 }
 
+# Метрики запросов (core.metrics): воркеры сбрасывают приращения в общий
+# файл не чаще раза в METRICS_FLUSH_INTERVAL секунд, /metrics отдаётся
+# только с METRICS_ALLOWED_IPS
+METRICS_PATH = os.path.join(BASE_DIR, 'cache', 'metrics.sqlite3')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+# Поиск N+1 (core.nplusone): больше NPLUSONE_THRESHOLD одинаковых SELECT
+# за запрос — предупреждение при DEBUG и ошибка в тестах
+NPLUSONE_THRESHOLD = 5
+NPLUSONE_ACTION = 'warn' if DEBUG else None
+# Отпечатки известных и допустимых повторов
+NPLUSONE_IGNORE = ()
+
+# Профилирование запросов (core.profiling): доля случайных запросов или
+# запрос с подписанным заголовком X-Profile, дампы pstats с ограничением
+# по числу файлов
+PROFILING_SAMPLE_RATE = 0
+PROFILING_DIR = os.path.join(BASE_DIR, 'cache', 'profiles')
+PROFILING_MAX_FILES = 500
+PROFILING_TOKEN_MAX_AGE = 60 * 60
+
+# Миниатюры картинок постов (posts.thumbnails): размеры для
+# {% post_picture %} готовит пул из THUMBNAIL_WORKERS потоков после
+# сохранения поста, 0 — прямо в запросе. Каждый размер — в долях ширины
+# POST_THUMBNAIL_SCALES для srcset и в форматах POST_THUMBNAIL_FORMATS,
+# которые умеет Pillow; последний формат — запасной для <img>
+POST_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+POST_THUMBNAIL_SCALES = (0.5, 1)
+POST_THUMBNAIL_FORMATS = ('AVIF', 'WEBP', 'JPEG')
+THUMBNAIL_BACKEND = 'posts.thumbnails.ThumbnailBackend'
+# Приём картинок постов (posts.images): больше IMAGE_MAX_PIXELS не
+# декодируется, больше IMAGE_MAX_SIDE по стороне уменьшается
+IMAGE_MAX_PIXELS = 50 * 10 ** 6
+IMAGE_MAX_SIDE = 2048
+IMAGE_JPEG_QUALITY = 85
+THUMBNAIL_WORKERS = 2
+# Картинки нужного размера по подписанному URL (posts.resize): готовые
+# лежат в RESIZE_CACHE_DIR, сверх RESIZE_CACHE_MAX_BYTES вытесняются
+# давно не читанные, браузер кэширует их на RESIZE_MAX_AGE
+RESIZE_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'resized')
+RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+RESIZE_MAX_AGE = 60 * 60 * 24 * 365
+
 INSTALLED_APPS = [
     'core.apps.CoreConfig',
     'about.apps.AboutConfig',
@@ -75,6 +162,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.nplusone.NPlusOneMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -89,7 +179,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.metrics.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -155,3 +245,18 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Тесты. Бэкенды те же, что в работе, но кэш, метрики и картинки лежат
+# во временном каталоге запуска: тесты работают с пустой базой и не
+# должны видеть записи боевого кэша. Миниатюры делаются в самом запросе,
+# пул проверяют тесты с override_settings(THUMBNAIL_WORKERS=...)
+TESTING = 'test' in sys.argv or 'pytest' in sys.modules
+if TESTING:
+    TEST_DIR = tempfile.mkdtemp(prefix='yatube-test-')
+    atexit.register(shutil.rmtree, TEST_DIR, ignore_errors=True)
+    CACHES['shared']['LOCATION'] = os.path.join(TEST_DIR, 'cache.sqlite3')
+    METRICS_PATH = os.path.join(TEST_DIR, 'metrics.sqlite3')
+    PROFILING_DIR = os.path.join(TEST_DIR, 'profiles')
+    RESIZE_CACHE_DIR = os.path.join(TEST_DIR, 'resized')
+    NPLUSONE_ACTION = 'raise'
+    THUMBNAIL_WORKERS = 0